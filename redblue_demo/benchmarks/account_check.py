@@ -0,0 +1,161 @@
+"""
+This module checks per-account dependencies on a simulated cluster.
+
+A deposit on one account must apply while a deposit on another account
+from the same origin is still in flight, which full dependencies do not
+allow. Random deposits and red withdrawals over two token partitions must
+then leave every replica with the same balances, and the operation logs
+the replicas record must only replay with the mode they were recorded with.
+"""
+
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+from queue import Queue
+from xmlrpc.client import loads
+
+from redblue_demo.benchmarks.replay import replay
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.bank_storage import INIT_BALANCE
+from redblue_demo.common.common import REQ, Request
+from redblue_demo.server.server import (
+    DEPENDENCY_ACCOUNT,
+    DEPENDENCY_FULL,
+    RequestItem,
+    ServerConfig,
+)
+
+NUM_SERVERS = 3
+NUM_ACCOUNTS = 10
+ROUNDS = 600
+
+
+def deliver_op(network: LocalNetwork, dst: int, aid: int) -> None:
+    """
+    Delivers the shadow operation on account `aid` in flight to server
+    `dst`, and leaves the other messages in flight.
+    """
+    for i, (_, msg_dst, payload) in enumerate(network.in_flight):
+        params, method = loads(payload)
+        if msg_dst == dst and method == "add_shadow_op" and params[0]["aid"] == aid:
+            del network.in_flight[i]
+            getattr(network.servers[dst], method)(*params)
+            return
+    raise AssertionError(f"no operation on account {aid} in flight to server {dst}")
+
+
+def applies_out_of_order(dependency: str) -> bool:
+    """
+    Sends two deposits on different accounts from server 0, and delivers
+    only the second one to server 1.
+
+    Returns:
+        bool: Whether server 1 applied it before the first one arrived.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    network = LocalNetwork(
+        [ServerConfig(i, addrs, dependency=dependency) for i in range(NUM_SERVERS)]
+    )
+    network.submit(0, Request(1, REQ.DEPOSIT, 1.0))
+    network.submit(0, Request(2, REQ.DEPOSIT, 1.0))
+    deliver_op(network, 1, 2)
+    network.servers[1]._step()
+    applied = network.servers[1].bank.get_account(2).get_balance() != INIT_BALANCE
+    assert network.servers[1].bank.get_account(1).get_balance() == INIT_BALANCE
+    network.drain()
+    for server in network.servers:
+        for aid in (1, 2):
+            assert server.bank.get_account(aid).get_balance() == INIT_BALANCE + 1.0
+    return applied
+
+
+def check_isolation() -> None:
+    """
+    Checks that only per-account dependencies let an operation pass an
+    earlier one of its origin on another account.
+    """
+    assert applies_out_of_order(DEPENDENCY_ACCOUNT)
+    assert not applies_out_of_order(DEPENDENCY_FULL)
+
+
+def check_random_workload(tmp: str) -> None:
+    """
+    Runs random deposits and red withdrawals while the tokens of two
+    partitions move around, and checks that the replicas converge and that
+    their logs replay.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    configs = [
+        ServerConfig(
+            i,
+            addrs,
+            dependency=DEPENDENCY_ACCOUNT,
+            num_partitions=2,
+            record_path=os.path.join(tmp, f"ops{i}.log"),
+        )
+        for i in range(NUM_SERVERS)
+    ]
+    network = LocalNetwork(configs, seed=2, hold_rounds=3)
+    network.start_tokens()
+    rand = random.Random(1)
+
+    pending = []
+    for _ in range(ROUNDS):
+        res_queue = Queue()
+        op = rand.choice((REQ.DEPOSIT, REQ.WITHDRAW))
+        req = Request(rand.randrange(NUM_ACCOUNTS), op, 3.0)
+        network.servers[rand.randrange(NUM_SERVERS)].req_queue.put(
+            RequestItem(req=req, res_queue=res_queue, deadline=float("inf"))
+        )
+        pending.append(res_queue)
+        network.step()
+        network.deliver(rand.randrange(2 * NUM_SERVERS))
+    for _ in range(LocalNetwork.MAX_ROUNDS):
+        if all(not res_queue.empty() for res_queue in pending):
+            break
+        network.step()
+        network.deliver()
+    assert all(not res_queue.empty() for res_queue in pending)
+
+    network.drain()
+    reference = network.servers[0]
+    for server in network.servers:
+        assert server.now.b == reference.now.b
+        assert server.now.r == reference.now.r
+        assert not server.op_list
+        for aid in range(NUM_ACCOUNTS):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+        server.recorder.close()
+
+    for i in range(NUM_SERVERS):
+        path = os.path.join(tmp, f"ops{i}.log")
+        assert replay(path, shuffle=True)["pending"] == 0
+        try:
+            replay(path, dependency=DEPENDENCY_FULL)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a log was replayed with another dependency mode")
+
+
+def main():
+    """
+    Runs the per-account dependency checks.
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_isolation()
+    print("isolation: an operation passes an earlier one on another account")
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            with redirect_stdout(devnull):
+                check_random_workload(tmp)
+    print("random workload: converged, logs replay in their own mode only")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+This module benchmarks what receiving a shadow operation costs the process
+that applies it, with and without decode workers, for clocks of 8, 16 and
+32 replicas.
+
+Without workers that process parses the xmlrpc message and builds the
+operation from it. With workers it only pops a fixed-layout record from a
+shared memory ring and unpacks it.
+"""
+
+import sys
+import time
+from xmlrpc.client import dumps, loads
+
+from redblue_demo.common.common import COLOR
+from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.shm_ring import ShmRing
+from redblue_demo.common.vector_clock import VectorClock
+from redblue_demo.server.decode_worker import SHADOW, pack_shadow, unpack_shadow
+
+NUM_OPS = 20000
+
+
+def make_op(num_server: int) -> ShadowOp:
+    """
+    Returns a shadow operation with a clock of `num_server` entries.
+    """
+    depend = VectorClock(num_server)
+    depend.b = [1000 + i for i in range(num_server)]
+    return ShadowOp(7, 1, depend, 1.0, COLOR.BLUE)
+
+
+def run_xmlrpc(num_server: int) -> float:
+    """
+    Returns the seconds per operation to parse and build it.
+    """
+    payload = dumps((make_op(num_server),), "add_shadow_op", allow_none=True)
+    start = time.perf_counter()
+    for _ in range(NUM_OPS):
+        params, _ = loads(payload)
+        ShadowOp.from_dict(params[0])
+    return (time.perf_counter() - start) / NUM_OPS
+
+
+def run_ring(num_server: int) -> float:
+    """
+    Returns the seconds per operation to pop and unpack it.
+    """
+    ring = ShmRing(SHADOW.size, NUM_OPS)
+    record = pack_shadow(make_op(num_server))
+    for _ in range(NUM_OPS):
+        ring.push(record)
+    start = time.perf_counter()
+    for _ in range(NUM_OPS):
+        unpack_shadow(ring.pop())
+    elapsed = time.perf_counter() - start
+    ring.close()
+    return elapsed / NUM_OPS
+
+
+def main():
+    """
+    Prints a table of the per operation costs in microseconds.
+    """
+    print(f"{'replicas':>8} {'xmlrpc us/op':>13} {'ring us/op':>11}")
+    for num_server in (8, 16, 32):
+        xmlrpc = run_xmlrpc(num_server) * 1e6
+        ring = run_ring(num_server) * 1e6
+        print(f"{num_server:>8} {xmlrpc:>13.1f} {ring:>11.1f}")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
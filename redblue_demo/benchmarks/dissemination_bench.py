@@ -0,0 +1,96 @@
+"""
+This module benchmarks the shadow operation dissemination modes on
+simulated clusters of 8, 16 and 32 replicas.
+
+Every replica generates deposits while messages are delivered in random
+order. At the end every replica must have applied every operation exactly
+once and hold the same balances.
+"""
+
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.common import REQ, Request
+from redblue_demo.server.server import (
+    DISSEMINATION_DIRECT,
+    DISSEMINATION_TREE,
+    ServerConfig,
+)
+
+NUM_OPS = 400
+NUM_HOT_ACCOUNTS = 50
+
+
+def run(num_server: int, dissemination: str, fanout: int = 2) -> dict:
+    """
+    Runs NUM_OPS deposits on a simulated cluster.
+
+    Returns:
+        dict: The measured numbers.
+    """
+    addrs = [f"local:{i}" for i in range(num_server)]
+    configs = [
+        ServerConfig(i, addrs, dissemination=dissemination, fanout=fanout)
+        for i in range(num_server)
+    ]
+    network = LocalNetwork(configs)
+    rand = random.Random(1)
+
+    start = time.perf_counter()
+    for _ in range(NUM_OPS):
+        origin = rand.randrange(num_server)
+        aid = rand.randrange(NUM_HOT_ACCOUNTS)
+        network.submit(origin, Request(aid, REQ.DEPOSIT, 1.0))
+        network.deliver(rand.randrange(2 * num_server))
+        network.step()
+    network.drain()
+    elapsed = time.perf_counter() - start
+
+    # every replica applied every operation exactly once
+    reference = network.servers[0]
+    assert sum(reference.now.b) == NUM_OPS
+    for server in network.servers:
+        assert server.now.b == reference.now.b
+        assert not server.op_list
+        for aid in range(NUM_HOT_ACCOUNTS):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+
+    return {
+        "origin_msgs_per_op": sum(network.origin_sent) / NUM_OPS,
+        "peak_node_msgs_per_op": max(network.sent) / NUM_OPS,
+        "total_msgs_per_op": sum(network.sent) / NUM_OPS,
+        "bytes_per_op": sum(network.sent_bytes) / NUM_OPS,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    """
+    Prints a table of the dissemination modes at 8, 16 and 32 replicas.
+    """
+    print(
+        f"{'replicas':>8} {'mode':>8} {'origin/op':>10} {'peak node/op':>12} "
+        f"{'total/op':>9} {'bytes/op':>9} {'seconds':>8}"
+    )
+    for num_server in (8, 16, 32):
+        for mode in (DISSEMINATION_DIRECT, DISSEMINATION_TREE):
+            with open(os.devnull, "w", encoding="utf-8") as devnull:
+                with redirect_stdout(devnull):
+                    res = run(num_server, mode)
+            print(
+                f"{num_server:>8} {mode:>8} {res['origin_msgs_per_op']:>10.2f} "
+                f"{res['peak_node_msgs_per_op']:>12.2f} {res['total_msgs_per_op']:>9.2f} "
+                f"{res['bytes_per_op']:>9.0f} {res['seconds']:>8.2f}"
+            )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
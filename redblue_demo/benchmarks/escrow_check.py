@@ -0,0 +1,164 @@
+"""
+This module checks escrow withdrawals on a simulated cluster.
+
+Random deposits and withdrawals, many larger than the local share, run
+while the tokens move around. No replica may ever see a negative balance or
+share, and in the end all replicas must agree. Then the token holder must
+move the pool back into its share, skipping the accounts whose share it
+released on request without letting them hold up the others.
+"""
+
+import os
+import random
+import time
+from contextlib import redirect_stdout
+from queue import Queue
+
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.bank_storage import INIT_BALANCE
+from redblue_demo.common.common import REQ, TOKEN_HOLD, Request
+from redblue_demo.server.server import MIN_GRANT, REESCROW_BATCH, RequestItem, ServerConfig
+
+NUM_SERVERS = 3
+NUM_ACCOUNTS = 10
+ROUNDS = 400
+
+
+def check_invariants(network: LocalNetwork, num_accounts: int) -> None:
+    """
+    Asserts that no replica has a negative balance or share.
+    """
+    for server in network.servers:
+        for aid in range(num_accounts):
+            assert server.bank.get_account(aid).get_balance() >= 0, (server.id, aid)
+            for i in range(NUM_SERVERS):
+                assert server.escrow.share(aid, i) >= -1e-9, (server.id, aid, i)
+
+
+def check_converged(network: LocalNetwork, num_accounts: int) -> None:
+    """
+    Asserts that all replicas hold the same balances and shares.
+    """
+    network.drain()
+    reference = network.servers[0]
+    for server in network.servers:
+        assert server.now.b == reference.now.b
+        assert server.now.r == reference.now.r
+        assert not server.op_list
+        for aid in range(num_accounts):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+            for i in range(NUM_SERVERS):
+                assert server.escrow.share(aid, i) == reference.escrow.share(aid, i)
+
+
+def check_random_workload() -> None:
+    """
+    Runs random deposits and withdrawals and checks the balances every round.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    configs = [
+        ServerConfig(i, addrs, escrow=True, num_partitions=2) for i in range(NUM_SERVERS)
+    ]
+    network = LocalNetwork(configs, hold_rounds=3)
+    network.start_tokens()
+    rand = random.Random(1)
+
+    pending = []
+    for _ in range(ROUNDS):
+        res_queue = Queue()
+        op = rand.choice((REQ.DEPOSIT, REQ.WITHDRAW, REQ.WITHDRAW))
+        req = Request(rand.randrange(NUM_ACCOUNTS), op, float(rand.randrange(1, 500)))
+        network.servers[rand.randrange(NUM_SERVERS)].req_queue.put(
+            RequestItem(req=req, res_queue=res_queue, deadline=float("inf"))
+        )
+        pending.append(res_queue)
+        network.step()
+        network.deliver(rand.randrange(2 * NUM_SERVERS))
+        check_invariants(network, NUM_ACCOUNTS)
+
+    # asking the peers to release their shares again waits on the wall clock
+    deadline = time.monotonic() + 10 * TOKEN_HOLD
+    while time.monotonic() < deadline:
+        if all(not res_queue.empty() for res_queue in pending):
+            break
+        network.step()
+        network.deliver()
+        check_invariants(network, NUM_ACCOUNTS)
+    assert all(not res_queue.empty() for res_queue in pending)
+    check_converged(network, NUM_ACCOUNTS)
+    check_invariants(network, NUM_ACCOUNTS)
+
+
+def hold_token(network: LocalNetwork, index: int) -> None:
+    """
+    Gives server `index` the token for a round and lets everybody catch up.
+    """
+    network.drain()
+    network.hand_token(index)
+    network.step()
+    network.drain()
+
+
+def check_reescrow() -> None:
+    """
+    Leaves held and free pool money on server 0's accounts, and checks that
+    the free accounts are moved back into its share at once, and the held
+    ones after the hold.
+    """
+    num_held = 2 * REESCROW_BATCH
+    num_accounts = num_held + 10
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    network = LocalNetwork([ServerConfig(i, addrs, escrow=True) for i in range(NUM_SERVERS)])
+    servers = network.servers
+    even = INIT_BALANCE / NUM_SERVERS
+
+    # server 0 releases its share of the first accounts on request, which
+    # it then leaves alone for a while
+    for aid in range(num_held):
+        servers[0]._release_escrow(aid)
+    # it spends most of its share of the others, whose pool server 1 fills
+    for aid in range(num_held, num_accounts):
+        res = network.submit(0, Request(aid, REQ.WITHDRAW, 300.0))
+        assert res is not None and res.status == 0
+        servers[1]._release_escrow(aid)
+    network.drain()
+
+    hold_token(network, 0)
+    check_converged(network, num_accounts)
+    check_invariants(network, num_accounts)
+    for aid in range(num_held, num_accounts):
+        balance = servers[0].bank.get_account(aid).get_balance()
+        assert servers[0].escrow.share(aid, 0) >= balance / NUM_SERVERS - MIN_GRANT, aid
+    for aid in range(num_held):
+        assert servers[0].escrow.share(aid, 0) == 0
+    assert len(servers[0].pool_accounts[0]) >= num_held
+
+    # the hold runs on the wall clock
+    time.sleep(NUM_SERVERS * TOKEN_HOLD + 0.1)
+    for _ in range(num_held // REESCROW_BATCH):
+        hold_token(network, 0)
+    check_converged(network, num_accounts)
+    check_invariants(network, num_accounts)
+    for aid in range(num_held):
+        assert abs(servers[0].escrow.share(aid, 0) - even) < MIN_GRANT, aid
+
+
+def main():
+    """
+    Runs the escrow checks.
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_random_workload()
+    print("random workload: no negative balance or share, converged")
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_reescrow()
+    print("re-escrow: free accounts first, held accounts after the hold")
+
+
+if __name__ == "__main__":
+    main()
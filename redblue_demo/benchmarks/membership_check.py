@@ -0,0 +1,125 @@
+"""
+This module checks dynamic membership on a simulated cluster.
+
+Servers join while shadow operations are still in flight and leave while
+others keep generating deposits. At the end every member must have applied
+every operation exactly once and hold the same balances. A join that a
+member cannot catch up, because its op log is too short, must be refused
+and leave the cluster as it was.
+"""
+
+import os
+import random
+from contextlib import redirect_stdout
+
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.common import REQ, Request
+from redblue_demo.server.server import ServerConfig
+
+NUM_SERVERS = 3
+NUM_ACCOUNTS = 20
+
+
+def deposits(network: LocalNetwork, count: int, rand: random.Random) -> None:
+    """
+    Submits `count` deposits to random members and delivers some messages
+    after each, so that a few are always in flight.
+    """
+    members = [server.id for server in network.servers if server.running]
+    for _ in range(count):
+        origin = rand.choice(members)
+        network.submit(origin, Request(rand.randrange(NUM_ACCOUNTS), REQ.DEPOSIT, 1.0))
+        network.deliver(rand.randrange(len(members)))
+        network.step()
+
+
+def check_converged(network: LocalNetwork, total: int) -> None:
+    """
+    Asserts that every member applied all `total` operations and holds the
+    same balances.
+    """
+    network.drain()
+    members = [server for server in network.servers if server.running]
+    reference = members[0]
+    assert sum(reference.now.b) == total, (reference.now.b, total)
+    for server in members:
+        assert server.addrs == reference.addrs
+        assert server.now.b == reference.now.b, (server.id, server.now.b, reference.now.b)
+        assert not server.op_list
+        for aid in range(NUM_ACCOUNTS):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+
+
+def check_join_leave() -> None:
+    """
+    Joins a server while operations are in flight, then lets a founding
+    member leave.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    network = LocalNetwork([ServerConfig(i, addrs) for i in range(NUM_SERVERS)])
+    rand = random.Random(1)
+
+    deposits(network, 60, rand)
+    network.hand_token(1)
+    new_id = network.join(1)
+    assert network.servers[new_id].running
+    deposits(network, 60, rand)
+    check_converged(network, 120)
+
+    network.hand_token(2)
+    network.leave(2)
+    assert not network.servers[2].running
+    deposits(network, 60, rand)
+    check_converged(network, 180)
+    for server in network.servers:
+        if server.running:
+            assert server.addrs[2] is None
+
+
+def check_short_op_log() -> None:
+    """
+    Joins a server while a member has more operations in flight than its op
+    log holds. The join must fail, and succeed once they arrived.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    network = LocalNetwork(
+        [ServerConfig(i, addrs, op_log_size=5) for i in range(NUM_SERVERS)]
+    )
+    for _ in range(20):
+        network.submit(0, Request(0, REQ.DEPOSIT, 1.0))
+    network.hand_token(1)
+    try:
+        network.join(1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a join that cannot be caught up was admitted")
+    check_converged(network, 20)
+    for server in network.servers:
+        if server.running:
+            assert server.addrs[NUM_SERVERS] is None
+
+    network.hand_token(1)
+    network.join(1)
+    check_converged(network, 20)
+
+
+def main():
+    """
+    Runs the membership checks.
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_join_leave()
+    print("join and leave: converged")
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_short_op_log()
+    print("join past a short op log: refused, then admitted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+This module benchmarks red throughput with 1, 2 and 4 red token partitions
+on a simulated cluster of 3 replicas.
+
+Every replica has a backlog of red withdrawals on random accounts and
+commits at most CAPACITY of them per round, standing in for its CPU. A red
+withdrawal commits only on the replica that holds the token of its
+partition, so with one partition a single replica works at a time, and
+more partitions let more replicas commit at once. The tokens move on after
+HOLD_ROUNDS rounds. At the end every replica must have applied every
+operation and hold the same balances.
+"""
+
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.common import REQ, Request
+from redblue_demo.server.server import ServerConfig
+
+NUM_SERVERS = 3
+NUM_ACCOUNTS = 64
+# The red withdrawals waiting on every replica.
+BACKLOG = 256
+# The red withdrawals a replica commits per round.
+CAPACITY = 4
+# The rounds a replica holds a token.
+HOLD_ROUNDS = 5
+ROUNDS = 600
+AMOUNT = 0.01
+
+
+def run(num_partitions: int) -> dict:
+    """
+    Runs ROUNDS rounds of red withdrawals with `num_partitions` tokens.
+
+    Returns:
+        dict: The measured numbers.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    configs = [
+        ServerConfig(i, addrs, num_partitions=num_partitions)
+        for i in range(NUM_SERVERS)
+    ]
+    network = LocalNetwork(configs, hold_rounds=HOLD_ROUNDS)
+    network.start_tokens()
+    rand = random.Random(1)
+    backlogs = [
+        [rand.randrange(NUM_ACCOUNTS) for _ in range(BACKLOG)] for _ in range(NUM_SERVERS)
+    ]
+
+    committed = 0
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        network.step()
+        network.deliver()
+        for server, backlog in zip(network.servers, backlogs):
+            # the oldest withdrawals whose token the replica holds
+            ready = [
+                aid for aid in backlog if server._primary(server._partition(aid))
+            ][:CAPACITY]
+            for aid in ready:
+                backlog.remove(aid)
+                res = network.submit(server.id, Request(aid, REQ.WITHDRAW, AMOUNT))
+                assert res is not None and res.status == 0
+                backlog.append(rand.randrange(NUM_ACCOUNTS))
+            committed += len(ready)
+    elapsed = time.perf_counter() - start
+
+    network.drain()
+    reference = network.servers[0]
+    assert sum(reference.now.r) == committed, (reference.now.r, committed)
+    for server in network.servers:
+        assert server.now.b == reference.now.b
+        assert server.now.r == reference.now.r
+        assert not server.op_list
+        for aid in range(NUM_ACCOUNTS):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+
+    return {
+        "red_per_round": committed / ROUNDS,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    """
+    Prints a table of the red throughput at 1, 2 and 4 partitions.
+    """
+    print(f"{'partitions':>10} {'red/round':>10} {'of max':>7} {'seconds':>8}")
+    for num_partitions in (1, 2, 4):
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            with redirect_stdout(devnull):
+                res = run(num_partitions)
+        share = res["red_per_round"] / (CAPACITY * NUM_SERVERS)
+        print(
+            f"{num_partitions:>10} {res['red_per_round']:>10.2f} {share:>7.0%} "
+            f"{res['seconds']:>8.2f}"
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+This module replays a recorded operation log through the apply loop of a
+fresh Server, without any RPC or token timing, and reports how fast the
+operations are applied.
+
+Usage: python replay.py LOG [--shuffle] [--seed N] [--batch N] [--dependency MODE]
+
+With --shuffle the operations arrive in random order instead of the
+recorded one, which exercises the pending buffer of not yet ready
+operations. The dependency mode defaults to the one the log records.
+"""
+
+import argparse
+import os
+import random
+import time
+from contextlib import redirect_stdout
+from typing import Optional
+
+from redblue_demo.common.bank_storage import NUM_ACCOUNTS
+from redblue_demo.common.op_log import read_op_log, read_op_log_dependency
+from redblue_demo.server.server import Server, ServerConfig
+
+
+def replay(
+    path: str,
+    shuffle: bool = False,
+    seed: int = 0,
+    batch: int = 1,
+    dependency: Optional[str] = None,
+) -> dict:
+    """
+    Feeds the operations of a log through a fresh Server apply loop.
+
+    Args:
+        path (str): The path of the operation log.
+        shuffle (bool): Whether to shuffle the arrival order.
+        seed (int): The seed of the shuffle.
+        batch (int): The number of operations that arrive between two runs
+            of the apply loop.
+        dependency (Optional[str]): The dependency mode to replay with, by
+            default the one the log was recorded with.
+
+    Returns:
+        dict: The measured numbers.
+
+    Raises:
+        ValueError: If the log was recorded with another dependency mode,
+            whose clocks would make operations look like duplicates.
+    """
+    recorded = read_op_log_dependency(path)
+    if dependency is None:
+        dependency = recorded
+    elif recorded != dependency:
+        raise ValueError(f"{path} was recorded with {recorded} dependencies")
+    records = list(read_op_log(path))
+    ops = [op for _, op in records]
+    if not ops:
+        raise ValueError(f"{path} holds no operations")
+
+    num_server = max(len(op.depend.b) for op in ops)
+    local = [op.server_id for is_local, op in records if is_local]
+    # without local operations, replay on a server that originated nothing
+    index = local[0] if local else num_server
+    num_server = max(num_server, index + 1)
+    max_aid = max(op.aid for op in ops)
+    config = ServerConfig(
+        index,
+        [f"replay:{i}" for i in range(num_server)],
+        num_partitions=len(ops[0].depend.r),
+        escrow=any(op.escrow for op in ops),
+        sparse_storage=max_aid >= NUM_ACCOUNTS,
+        num_accounts=max(NUM_ACCOUNTS, max_aid + 1),
+        dependency=dependency,
+    )
+    server = Server.from_config(config)
+
+    if shuffle:
+        random.Random(seed).shuffle(ops)
+
+    peak = 0
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            start = time.perf_counter()
+            for i in range(0, len(ops), batch):
+                for op in ops[i : i + batch]:
+                    server.shadow_queue.put(op)
+                server._process_shadow_queue()
+                peak = max(peak, len(server.op_list))
+                server._process_op_list()
+            elapsed = time.perf_counter() - start
+
+    applied = sum(server.now.b)
+    return {
+        "records": len(ops),
+        "applied": applied,
+        "pending": len(server.op_list),
+        "seconds": elapsed,
+        "ops_per_sec": applied / elapsed if elapsed > 0 else float("inf"),
+        "peak_pending": peak,
+    }
+
+
+def main():
+    """
+    Parses the command line arguments, replays the log and prints the numbers.
+    """
+    parser = argparse.ArgumentParser(description="Replay a recorded operation log")
+    parser.add_argument("log")
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--dependency", choices=["full", "account"], default=None)
+    args = parser.parse_args()
+
+    res = replay(args.log, args.shuffle, args.seed, args.batch, args.dependency)
+    order = "shuffled" if args.shuffle else "recorded"
+    print(f"{res['records']} records replayed in {order} order")
+    print(f"applied       {res['applied']}")
+    print(f"still pending {res['pending']}")
+    print(f"seconds       {res['seconds']:.3f}")
+    print(f"ops/s         {res['ops_per_sec']:.0f}")
+    print(f"peak pending  {res['peak_pending']}")
+
+
+if __name__ == "__main__":
+    main()
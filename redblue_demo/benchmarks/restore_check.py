@@ -0,0 +1,143 @@
+"""
+This module checks restoring a server from a checkpoint on a simulated
+cluster.
+
+A server takes a checkpoint while shadow operations are still in flight,
+stops, and starts again from the checkpoint while the others went on. The
+members must resend what the checkpoint does not cover, so that in the end
+every member holds the same balances. A server that generated operations
+after its checkpoint cannot be restored, because they are lost with it.
+"""
+
+import os
+import random
+import tempfile
+import time
+from contextlib import redirect_stdout
+from queue import Queue
+
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.common import REQ, Request
+from redblue_demo.server.server import ServerConfig
+
+NUM_SERVERS = 3
+NUM_ACCOUNTS = 20
+
+
+def make_network(tmp: str) -> LocalNetwork:
+    """
+    Starts a cluster whose balances live in balance files under `tmp`.
+    """
+    addrs = [f"local:{i}" for i in range(NUM_SERVERS)]
+    return LocalNetwork(
+        [
+            ServerConfig(
+                i,
+                addrs,
+                storage_path=os.path.join(tmp, f"bal{i}"),
+                num_accounts=NUM_ACCOUNTS,
+            )
+            for i in range(NUM_SERVERS)
+        ]
+    )
+
+
+def deposits(network: LocalNetwork, origins: list, count: int, rand: random.Random) -> None:
+    """
+    Submits `count` deposits to random servers of `origins` and delivers
+    some messages after each, so that a few are always in flight.
+    """
+    for _ in range(count):
+        origin = rand.choice(origins)
+        network.submit(origin, Request(rand.randrange(NUM_ACCOUNTS), REQ.DEPOSIT, 1.0))
+        network.deliver(rand.randrange(NUM_SERVERS))
+        network.step()
+
+
+def checkpoint(network: LocalNetwork, index: int, dest: str) -> None:
+    """
+    Takes a checkpoint of server `index` without delivering any message.
+    """
+    res_queue = Queue()
+    network.servers[index].checkpoint_queue.put((dest, res_queue, float("inf")))
+    while res_queue.empty():
+        # the copy runs on a thread of its own
+        network.step()
+        time.sleep(0.001)
+    assert res_queue.get() is True
+
+
+def check_converged(network: LocalNetwork, total: int) -> None:
+    """
+    Asserts that every server applied all `total` operations and holds the
+    same balances.
+    """
+    network.drain()
+    reference = network.servers[0]
+    assert sum(reference.now.b) == total, (reference.now.b, total)
+    for server in network.servers:
+        assert server.now.b == reference.now.b, (server.id, server.now.b, reference.now.b)
+        assert not server.op_list
+        for aid in range(NUM_ACCOUNTS):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+
+
+def check_restore() -> None:
+    """
+    Restores a server that stopped after its checkpoint while the others
+    kept generating deposits.
+    """
+    rand = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        network = make_network(tmp)
+        everyone = list(range(NUM_SERVERS))
+        deposits(network, everyone, 60, rand)
+        cp = os.path.join(tmp, "bal2.cp")
+        checkpoint(network, 2, cp)
+        # what server 2 applies from now on is lost when it stops
+        deposits(network, [0, 1], 60, rand)
+        network.restore(2, cp)
+        deposits(network, everyone, 60, rand)
+        check_converged(network, 180)
+
+
+def check_lost_ops() -> None:
+    """
+    Restores a server whose deposits after the checkpoint reached the
+    others. The restore must be refused.
+    """
+    rand = random.Random(2)
+    with tempfile.TemporaryDirectory() as tmp:
+        network = make_network(tmp)
+        deposits(network, list(range(NUM_SERVERS)), 20, rand)
+        cp = os.path.join(tmp, "bal2.cp")
+        checkpoint(network, 2, cp)
+        deposits(network, [2], 1, rand)
+        network.drain()
+        try:
+            network.restore(2, cp)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a server that lost operations was restored")
+
+
+def main():
+    """
+    Runs the restore checks.
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_restore()
+    print("restore: caught up from the members' op logs, converged")
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with redirect_stdout(devnull):
+            check_lost_ops()
+    print("restore past operations of its own: refused")
+
+
+if __name__ == "__main__":
+    main()
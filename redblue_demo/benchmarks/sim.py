@@ -0,0 +1,340 @@
+"""
+This module contains an in-process network for simulating a cluster of
+servers without sockets, used by the benchmarks.
+"""
+
+import copy
+import random
+from queue import Queue
+from typing import Callable, List, Optional
+from xmlrpc.client import Fault, dumps, loads
+
+from redblue_demo.client.client import Client
+from redblue_demo.common.clock_delta import ClockEncoder
+from redblue_demo.common.common import Request
+from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.vector_clock import VectorClock
+from redblue_demo.server.server import RequestItem, Server, ServerConfig
+
+
+class LocalNetwork:
+    """
+    Delivers xmlrpc encoded messages between simulated servers.
+
+    Attributes:
+        servers (List[Server]): The simulated servers, indexed by id.
+        ids (dict): The id of the server at every address.
+        joining (set): The ids of the servers waiting for their snapshot.
+        in_flight (list): The messages sent but not delivered yet.
+        sent (List[int]): The number of messages sent by every server.
+        sent_bytes (List[int]): The number of payload bytes sent by every server.
+        origin_sent (List[int]): The number of messages every server sent
+            for shadow operations it generated itself.
+        shadow_sent (int): The number of shadow operation messages.
+        shadow_bytes (int): The number of payload bytes of shadow operation
+            messages.
+        ordered (bool): Whether messages between two servers are delivered
+            in the order they were sent, as delta encoded streams need.
+        hold_rounds (Optional[int]): How many rounds a server holds a red
+            token. If None, the hold time runs on the wall clock as usual.
+        rounds (int): The number of rounds run so far.
+        timers (list): The (round, server id, partition) ends of the token
+            hold times still to come.
+    """
+
+    # How many rounds join and leave run the network before giving up.
+    MAX_ROUNDS = 1000
+
+    def __init__(
+        self, configs: List[ServerConfig], seed: int = 0, hold_rounds: Optional[int] = None
+    ) -> None:
+        self.rand = random.Random(seed)
+        self.servers = []
+        self.ids = {addr: i for i, addr in enumerate(configs[0].addr)}
+        self.joining = set()
+        self.in_flight = []
+        self.sent = []
+        self.sent_bytes = []
+        self.origin_sent = []
+        self.shadow_sent = 0
+        self.shadow_bytes = 0
+        self.ordered = any(config.delta_clocks for config in configs)
+        self.hold_rounds = hold_rounds
+        self.rounds = 0
+        self.timers = []
+        for config in configs:
+            self._add_server(config)
+        for server in self.servers:
+            self._connect_peers(server)
+
+    def _add_server(self, config: ServerConfig) -> "LocalServer":
+        server = LocalServer.from_config(config)
+        server.network = self
+        self.servers.append(server)
+        self.sent.append(0)
+        self.sent_bytes.append(0)
+        self.origin_sent.append(0)
+        return server
+
+    @staticmethod
+    def _connect_peers(server: Server) -> None:
+        for i, addr in enumerate(server.addrs):
+            if i != server.id and addr is not None:
+                server.peers[i] = server._connect(addr)
+
+    def _encode(self, src: int, method: str, params: tuple) -> bytes:
+        payload = dumps(params, method, allow_none=True)
+        self.sent[src] += 1
+        self.sent_bytes[src] += len(payload)
+        if method.startswith("add_shadow_op"):
+            self.shadow_sent += 1
+            self.shadow_bytes += len(payload)
+        return payload
+
+    def send(self, src: int, dst: int, method: str, params: tuple) -> None:
+        """
+        Encodes a rpc call and puts it in flight.
+        """
+        self.in_flight.append((src, dst, self._encode(src, method, params)))
+
+    def deliver(self, count: int = -1) -> int:
+        """
+        Delivers up to `count` random messages in flight, all if negative.
+        On an ordered network, the oldest message between the same two
+        servers goes first.
+
+        Returns:
+            int: The number of delivered messages.
+        """
+        if count < 0 or count > len(self.in_flight):
+            count = len(self.in_flight)
+        for _ in range(count):
+            index = self.rand.randrange(len(self.in_flight))
+            if self.ordered:
+                src, dst, _ = self.in_flight[index]
+                index = next(
+                    i
+                    for i, msg in enumerate(self.in_flight)
+                    if msg[0] == src and msg[1] == dst
+                )
+                _, dst, payload = self.in_flight.pop(index)
+            else:
+                self.in_flight[index], self.in_flight[-1] = (
+                    self.in_flight[-1],
+                    self.in_flight[index],
+                )
+                _, dst, payload = self.in_flight.pop()
+            params, method = loads(payload)
+            getattr(self.servers[dst], method)(*params)
+        return count
+
+    def step(self) -> None:
+        """
+        Runs one main loop round on every server that is a member, and hands
+        on the tokens that reached servers that left.
+        """
+        self.rounds += 1
+        due = [timer for timer in self.timers if timer[0] <= self.rounds]
+        for timer in due:
+            self.timers.remove(timer)
+            self.servers[timer[1]].token_queue.put((timer[2], None))
+        for server in self.servers:
+            if server.running:
+                server._step()
+            elif server.id not in self.joining:
+                server._forward_tokens()
+
+    def drain(self) -> None:
+        """
+        Delivers messages until nothing is in flight any more.
+        """
+        while True:
+            self.step()
+            if not self.in_flight:
+                return
+            self.deliver()
+
+    def submit(self, index: int, req: Request):
+        """
+        Submits a request to a server and runs it right away.
+
+        Returns:
+            Response: The response of the server.
+        """
+        res_queue = Queue()
+        self.servers[index].req_queue.put(
+            RequestItem(req=req, res_queue=res_queue, deadline=float("inf"))
+        )
+        self.servers[index]._process_req_queue()
+        return res_queue.get_nowait() if not res_queue.empty() else None
+
+    def start_tokens(self) -> None:
+        """
+        Spreads the red tokens over the servers as they do when they start,
+        and starts their hold times.
+        """
+        for server in self.servers:
+            server._start_tokens()
+
+    def hand_token(self, index: int, partition: int = 0) -> None:
+        """
+        Moves the red token of a partition to a server, as the token
+        timeouts, which the simulation does not run, eventually would.
+        """
+        for server in self.servers:
+            server.has_token[partition] = False
+        self.servers[index].has_token[partition] = True
+
+    def _wait_member_change(self, index: int, item: tuple):
+        res_queue = Queue()
+        self.servers[index].member_queue.put(item + (res_queue, float("inf")))
+        for _ in range(self.MAX_ROUNDS):
+            if not res_queue.empty():
+                break
+            self.step()
+            self.deliver()
+        else:
+            raise RuntimeError(f"server {index} did not answer the membership change")
+        res = res_queue.get()
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    def join(self, seed: int) -> int:
+        """
+        Starts a server with the configuration of server `seed`, and runs the
+        network until it has joined the cluster through that server, which
+        must hold the token of partition 0 by then.
+
+        Returns:
+            int: The id of the new server.
+        """
+        new_id = len(self.servers)
+        addr = f"local:{new_id}"
+        config = copy.copy(self.servers[seed].config)
+        config.index = new_id
+        config.addr = [addr]
+        config.join = self.servers[seed].addrs[seed]
+        self.ids[addr] = new_id
+        server = self._add_server(config)
+        # catch-up operations may arrive before the snapshot, as they do
+        # over sockets, and wait in the queues until the server runs
+        server.running = False
+        self.joining.add(new_id)
+        snapshot = self._wait_member_change(seed, ("join", addr))
+        server._load_snapshot(loads(dumps((snapshot,), allow_none=True))[0][0])
+        self._connect_peers(server)
+        self.joining.discard(new_id)
+        server.running = True
+        return new_id
+
+    def restore(self, index: int, checkpoint: str) -> None:
+        """
+        Stops server `index`, dropping the messages in flight to it, and
+        starts it again from a checkpoint it took, as `--restore` does.
+
+        Raises:
+            ValueError: If a member cannot catch the server up.
+        """
+        self.in_flight = [msg for msg in self.in_flight if msg[1] != index]
+        config = copy.copy(self.servers[index].config)
+        config.restore_path = checkpoint
+        self.servers[index].bank.close()
+        server = LocalServer.from_config(config)
+        server.network = self
+        self.servers[index] = server
+        self._connect_peers(server)
+        server._rejoin()
+
+    def leave(self, index: int) -> None:
+        """
+        Runs the network until server `index` has left the cluster, which it
+        does once it holds the token of partition 0.
+        """
+        self._wait_member_change(index, ("leave", None))
+
+
+class LocalServer(Server):
+    """
+    A Server whose peers are LocalPeers of a LocalNetwork.
+
+    Attributes:
+        network (LocalNetwork): The network the server is part of.
+    """
+
+    network: LocalNetwork
+
+    def _connect(self, addr: str) -> Client:
+        dst = self.network.ids[addr]
+        return LocalPeer(self.network, self.id, dst, self.config.delta_clocks)
+
+    def _set_token_timeout(self, partition: int) -> None:
+        if self.network.hold_rounds is None:
+            super()._set_token_timeout(partition)
+            return
+        self.network.timers.append(
+            (self.network.rounds + self.network.hold_rounds, self.id, partition)
+        )
+
+
+class LocalPeer(Client):
+    """
+    A Client whose calls go through a LocalNetwork instead of a socket.
+    """
+
+    def __init__(
+        self, network: LocalNetwork, src: int, dst: int, delta_clocks: bool = False
+    ) -> None:
+        # pylint: disable=super-init-not-called
+        self.network = network
+        self.src = src
+        self.dst = dst
+        self.addr = f"local:{dst}"
+        self.stream = None
+        self.encoder = ClockEncoder(src) if delta_clocks else None
+
+    def pass_token(
+        self,
+        max_r: int,
+        partition: int = 0,
+        ops: Optional[list] = None,
+        clock: Optional[VectorClock] = None,
+        on_error: Optional[Callable[[], None]] = None,
+    ) -> None:
+        # the simulated network never refuses a token
+        params = (max_r, partition) if ops is None else (max_r, partition, ops, clock)
+        self.network.send(self.src, self.dst, "pass_token", params)
+
+    def add_shadow_op_async(self, op: ShadowOp) -> None:
+        if op.server_id == self.src:
+            self.network.origin_sent[self.src] += 1
+        if self.encoder is not None:
+            msg = self.encoder.encode(op)
+            self.network.send(self.src, self.dst, "add_shadow_op_delta", (msg,))
+        else:
+            self.network.send(self.src, self.dst, "add_shadow_op", (op,))
+
+    def release_escrow_async(self, aid: int) -> None:
+        self.network.send(self.src, self.dst, "release_escrow", (aid,))
+
+    def rejoin(self, index: int, clock: list) -> dict:
+        params, _ = loads(self.network._encode(self.src, "rejoin", (index, clock)))
+        server = self.network.servers[self.dst]
+        res_queue = Queue()
+        server.update_queue.put(({"rejoined": params[0], "clock": params[1]}, res_queue))
+        server._process_update_queue()
+        res = res_queue.get_nowait()
+        if isinstance(res, Exception):
+            # as SimpleXMLRPCServer reports an exception of the handler
+            raise Fault(1, f"{type(res)}:{res}")
+        return res
+
+    def update_members(self, update: dict) -> bool:
+        # the member answers from its main loop, which is run right here
+        # instead of blocking the only thread of the simulation
+        params, _ = loads(self.network._encode(self.src, "update_members", (update,)))
+        server = self.network.servers[self.dst]
+        res_queue = Queue()
+        server.update_queue.put((params[0], res_queue))
+        server._process_update_queue()
+        return res_queue.get_nowait()
@@ -0,0 +1,87 @@
+"""
+This module compares the dense and the sparse bank storage.
+
+For every account space size it measures the startup time, the memory
+allocated by the storage, and the rate of shadow operations applied to a
+fixed number of active accounts.
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+
+from redblue_demo.common.bank_storage import BankStorage
+from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.sparse_bank_storage import SparseBankStorage
+from redblue_demo.common.vector_clock import VectorClock
+
+NUM_ACTIVE = 10000
+NUM_OPS = 200000
+
+# the dense storage holds one object per account, larger spaces do not fit
+MAX_DENSE_ACCOUNTS = 1000000
+
+
+def run(storage_cls, num_accounts: int) -> dict:
+    """
+    Builds a storage and applies NUM_OPS deposits to NUM_ACTIVE accounts.
+
+    Returns:
+        dict: The measured numbers.
+    """
+    rand = random.Random(0)
+    active = [rand.randrange(num_accounts) for _ in range(NUM_ACTIVE)]
+    ops = [
+        ShadowOp(rand.choice(active), 0, VectorClock(1), rand.uniform(-1, 1))
+        for _ in range(NUM_OPS)
+    ]
+
+    # memory of the storage once every active account was touched
+    tracemalloc.start()
+    bank = storage_cls(num_accounts)
+    for op in ops:
+        op.apply(bank)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del bank
+
+    # timings without the tracing overhead
+    start = time.perf_counter()
+    bank = storage_cls(num_accounts)
+    startup = time.perf_counter() - start
+    start = time.perf_counter()
+    for op in ops:
+        op.apply(bank)
+    apply_seconds = time.perf_counter() - start
+
+    return {
+        "startup": startup,
+        "storage_mb": memory / 2**20,
+        "ops_per_sec": NUM_OPS / apply_seconds,
+    }
+
+
+def main():
+    """
+    Prints a table comparing the storages for growing account spaces.
+    """
+    print(
+        f"{'accounts':>11} {'storage':>7} {'startup s':>10} "
+        f"{'memory MB':>10} {'ops/s':>10}"
+    )
+    for num_accounts in (10000, 1000000, 100000000, 500000000):
+        for name, storage_cls in (("dense", BankStorage), ("sparse", SparseBankStorage)):
+            if storage_cls is BankStorage and num_accounts > MAX_DENSE_ACCOUNTS:
+                print(f"{num_accounts:>11} {name:>7} {'-':>10} {'-':>10} {'-':>10}")
+                continue
+            res = run(storage_cls, num_accounts)
+            print(
+                f"{num_accounts:>11} {name:>7} {res['startup']:>10.3f} "
+                f"{res['storage_mb']:>10.1f} {res['ops_per_sec']:>10.0f}"
+            )
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+This module benchmarks the size of shadow operation messages with whole
+and with delta encoded dependency clocks, on simulated clusters of 8 to 64
+replicas.
+
+The replicas generate deposits, either interleaved at random or in bursts
+of BURST deposits per replica, while messages are delivered in random order
+between, and in sent order within, every pair of replicas. At the end every
+replica must have applied every operation and hold the same balances.
+
+Between two messages on a stream, the clock changes in one entry per replica
+whose operations the sender applied meanwhile. Interleaved deposits thus
+change more entries as the cluster grows, while in bursts mostly only the
+origin's entry changes and the message size stays flat.
+"""
+
+import os
+import random
+import sys
+from contextlib import redirect_stdout
+
+from redblue_demo.benchmarks.sim import LocalNetwork
+from redblue_demo.common.common import REQ, Request
+from redblue_demo.server.server import ServerConfig
+
+NUM_OPS = 400
+NUM_HOT_ACCOUNTS = 50
+BURST = 20
+
+
+def run(num_server: int, delta_clocks: bool, burst: int = 1) -> dict:
+    """
+    Runs NUM_OPS deposits on a simulated cluster.
+
+    Returns:
+        dict: The measured numbers.
+    """
+    addrs = [f"local:{i}" for i in range(num_server)]
+    configs = [
+        ServerConfig(i, addrs, delta_clocks=delta_clocks) for i in range(num_server)
+    ]
+    network = LocalNetwork(configs)
+    # whole clocks do not need ordered delivery, but compare like with like
+    network.ordered = True
+    rand = random.Random(1)
+
+    for i in range(NUM_OPS):
+        if i % burst == 0:
+            origin = rand.randrange(num_server)
+        aid = rand.randrange(NUM_HOT_ACCOUNTS)
+        network.submit(origin, Request(aid, REQ.DEPOSIT, 1.0))
+        network.deliver(rand.randrange(2 * num_server))
+        network.step()
+    network.drain()
+
+    reference = network.servers[0]
+    assert sum(reference.now.b) == NUM_OPS
+    for server in network.servers:
+        assert server.now.b == reference.now.b
+        for aid in range(NUM_HOT_ACCOUNTS):
+            assert (
+                server.bank.get_account(aid).get_balance()
+                == reference.bank.get_account(aid).get_balance()
+            )
+
+    return {"bytes_per_msg": network.shadow_bytes / network.shadow_sent}
+
+
+def main():
+    """
+    Prints a table of the shadow operation message sizes.
+    """
+    print(
+        f"{'replicas':>8} {'whole B/msg':>12} {'delta B/msg':>12} "
+        f"{'whole burst':>12} {'delta burst':>12}"
+    )
+    for num_server in (8, 16, 32, 64):
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            with redirect_stdout(devnull):
+                res = [
+                    run(num_server, delta_clocks, burst)
+                    for burst in (1, BURST)
+                    for delta_clocks in (False, True)
+                ]
+        print(
+            f"{num_server:>8} "
+            + " ".join(f"{r['bytes_per_msg']:>12.0f}" for r in res)
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
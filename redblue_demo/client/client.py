@@ -3,11 +3,23 @@ This module contains the Client class for interacting with the rpc server.
 """
 
 import time
-from xmlrpc.client import ServerProxy
+from typing import Callable, List, Optional
+from xmlrpc.client import Error, ServerProxy
 import threading
+from redblue_demo.client.cluster_client import TimeoutTransport, rejected
+from redblue_demo.client.shadow_stream import ShadowStream
 from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.vector_clock import VectorClock
 from redblue_demo.common.common import SERVER_DELAY
 
+# Backoff bounds in seconds when a peer refuses the token.
+MIN_BACKOFF: float = 0.05
+MAX_BACKOFF: float = 2.0
+# How often a token is sent to a peer that refuses connections.
+TOKEN_RETRIES: int = 5
+# How long the token holder waits for a member to take a membership update.
+UPDATE_TIMEOUT: float = 5.0
+
 
 class Client:
     """
@@ -16,25 +28,48 @@ class Client:
 
     rpcClient: ServerProxy
 
-    def __init__(self, addr: str) -> None:
+    def __init__(self, addr: str, delta_sender: Optional[int] = None) -> None:
         """
         Initializes a new instance of the Client class.
 
         Args:
         addr (str): The address of the server.
+        delta_sender (Optional[int]): The ID of the sending server. If set,
+            shadow operations go through an ordered stream with delta
+            encoded clocks.
 
         Returns:
         None
         """
-        self.rpc_client = ServerProxy(addr)
+        self.rpc_client = ServerProxy(addr, allow_none=True)
         self.addr = addr
-
-    def pass_token(self, max_r: int) -> None:
+        self.delta_sender = delta_sender
+        # started with the first shadow operation
+        self.stream = None
+
+    def pass_token(
+        self,
+        max_r: int,
+        partition: int = 0,
+        ops: Optional[list] = None,
+        clock: Optional[VectorClock] = None,
+        on_error: Optional[Callable[[], None]] = None,
+    ) -> None:
         """
         Passes a token to the server asynchronously.
+        A server that refuses the connection, or has no thread to spare,
+        never got the token, so it is retried with exponential backoff. Other errors leave it unknown
+        whether the token arrived, and sending it again could duplicate it.
 
         Args:
         max_r (int): The red token.
+        partition (int): The partition of the token.
+        ops (Optional[list]): Shadow operations riding along, encoded
+            relative to `clock` by encode_ops.
+        clock (Optional[VectorClock]): The clock of the sender.
+        on_error (Optional[Callable[[], None]]): Called if the server still
+            refuses the token after TOKEN_RETRIES attempts, so that the
+            caller can hand it elsewhere.
 
         Returns:
         None
@@ -42,34 +77,127 @@ class Client:
 
         def task():
             time.sleep(SERVER_DELAY)
-            try:
-                self.rpc_client.pass_token(max_r)
-            except ValueError as e:
-                print(f"client.PassToken() : {e}")
+            backoff = MIN_BACKOFF
+            for _ in range(TOKEN_RETRIES):
+                try:
+                    proxy = ServerProxy(self.addr, allow_none=True)
+                    if ops is None:
+                        proxy.pass_token(max_r, partition)
+                    else:
+                        proxy.pass_token(max_r, partition, ops, clock)
+                    return
+                except (ValueError, OSError, Error) as e:
+                    if not rejected(e):
+                        print(f"client.PassToken() : {e}")
+                        return
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+            print(f"client.PassToken() : {self.addr} refused the token")
+            if on_error is not None:
+                on_error()
 
         threading.Thread(target=task).start()
 
     def add_shadow_op_async(self, op: ShadowOp) -> None:
         """
         Adds a shadow operation to the server asynchronously.
+        Shadow operations must not be lost, so the stream to the server
+        retries a busy or unreachable server with exponential backoff.
 
         Args:
         op (ShadowOp): The shadow operation to add.
 
+        Returns:
+        None
+        """
+        if self.stream is None:
+            self.stream = ShadowStream(self.addr, self.delta_sender)
+        self.stream.put(op)
+
+    def backlogged(self) -> bool:
+        """
+        Checks if too many shadow operations wait for the server, so that
+        the caller stops generating new ones until it catches up.
+
+        Returns:
+        bool: True if the stream to the server is backlogged.
+        """
+        return self.stream is not None and self.stream.backlogged()
+
+    def flush(self) -> None:
+        """
+        Waits until the stream has sent every queued shadow operation.
+
+        Returns:
+        None
+        """
+        if self.stream is not None:
+            self.stream.flush()
+
+    def close(self) -> None:
+        """
+        Stops sending shadow operations to a server that left the cluster.
+
+        Returns:
+        None
+        """
+        if self.stream is not None:
+            self.stream.close()
+
+    def release_escrow_async(self, aid: int) -> None:
+        """
+        Asks the server to release its escrow share of an account asynchronously.
+
+        Args:
+        aid (int): The account ID.
+
         Returns:
         None
         """
 
         def task():
             time.sleep(SERVER_DELAY)
-            rpc_client = ServerProxy(self.addr)
             try:
-                rpc_client.add_shadow_op(op)
-            except ValueError as e:
-                print(f"client.AddShadowOp() : {e}")
+                ServerProxy(self.addr).release_escrow(aid)
+            except (OSError, Error) as e:
+                print(f"client.ReleaseEscrow() : {e}")
 
         threading.Thread(target=task).start()
 
+    def update_members(self, update: dict) -> bool:
+        """
+        Sends a membership update to the server synchronously, so that it is
+        applied there before the token can follow it. The call times out, so
+        a server that hangs does not hold up the token holder.
+
+        Args:
+        update (dict): The membership update.
+
+        Returns:
+        bool: False if the server cannot catch up a server the update joins.
+        """
+        proxy = ServerProxy(
+            self.addr, transport=TimeoutTransport(UPDATE_TIMEOUT), allow_none=True
+        )
+        return proxy.update_members(update)
+
+    def rejoin(self, index: int, clock: List[int]) -> dict:
+        """
+        Asks the server to resend its shadow operations to a server restored
+        from a checkpoint, synchronously and with a timeout.
+
+        Args:
+        index (int): The index of the restored server.
+        clock (List[int]): The b entries of the checkpoint's clock.
+
+        Returns:
+        dict: The epoch and addresses of the membership.
+        """
+        proxy = ServerProxy(
+            self.addr, transport=TimeoutTransport(UPDATE_TIMEOUT), allow_none=True
+        )
+        return proxy.rejoin(index, clock)
+
     def request(self, req: dict) -> dict:
         """
         Sends a request to the server and returns the response.
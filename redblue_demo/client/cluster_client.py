@@ -0,0 +1,431 @@
+"""
+This module contains the ClusterClient class for interacting with a whole
+replica set instead of a single rpc server.
+"""
+
+import http.client
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from typing import List, Optional
+from xmlrpc.client import ProtocolError, ServerProxy, Transport
+from redblue_demo.common.common import HTTP_BUSY, REQUEST_TIMEOUT, STATUS_BUSY, TOKEN_HOLD
+
+# Errors after which a replica is considered unreachable.
+RETRYABLE_ERRORS = (OSError, http.client.HTTPException, ProtocolError)
+
+
+
+def rejected(error: Exception) -> bool:
+    """
+    Checks if a call failed before the server handled it, either because the
+    connection was refused or because the server had no thread to spare.
+    Such a call may be sent again anywhere.
+    """
+    if isinstance(error, ProtocolError):
+        return error.errcode == HTTP_BUSY
+    return isinstance(error, ConnectionRefusedError)
+
+
+POLICY_LEAST_OUTSTANDING = "least_outstanding"
+POLICY_LATENCY = "latency"
+
+# The server answers a request by its deadline plus one token hold, so a
+# client that gives up earlier may retry a write the server still commits.
+DEFAULT_TIMEOUT = REQUEST_TIMEOUT + 2 * TOKEN_HOLD
+
+
+class TimeoutTransport(Transport):
+    """
+    A xmlrpc transport whose connections time out instead of blocking forever.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.aborted = False
+
+    def make_connection(self, host):
+        if self.aborted:
+            # xmlrpc retries a reset keep-alive connection once, which must
+            # not resend an aborted call
+            raise ConnectionAbortedError("Call aborted")
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+    def abort(self) -> None:
+        """
+        Shuts down the open connection, so that a call blocked on it in
+        another thread fails right away. The transport is unusable after.
+        """
+        self.aborted = True
+        conn = self._connection[1]
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class Replica:
+    """
+    Client side bookkeeping for one replica.
+
+    Attributes:
+        addr (str): The address of the replica.
+        pool (Queue): Idle connections to the replica, which the server
+            keeps open between calls.
+        outstanding (int): The number of requests in flight.
+        latency (float): The moving average of the response time in seconds.
+        down_until (float): Until when the replica is skipped after a failure.
+    """
+
+    def __init__(self, addr: str, timeout: float) -> None:
+        self.addr = addr
+        self.timeout = timeout
+        self.pool = Queue()
+        self.outstanding = 0
+        self.latency = 0.0
+        self.down_until = 0.0
+
+    def acquire(self) -> ServerProxy:
+        """
+        Takes an idle connection from the pool or opens a new one.
+
+        Returns:
+            ServerProxy: A connection to the replica.
+        """
+        try:
+            return self.pool.get_nowait()
+        except Empty:
+            return ServerProxy(
+                self.addr, transport=TimeoutTransport(self.timeout), allow_none=True
+            )
+
+    def release(self, proxy: ServerProxy, pool_size: int) -> None:
+        """
+        Returns a healthy connection to the pool.
+
+        Args:
+            proxy (ServerProxy): The connection to return.
+            pool_size (int): The maximum number of idle connections kept.
+        """
+        if self.pool.qsize() < pool_size:
+            self.pool.put(proxy)
+
+    def available(self, now: float) -> bool:
+        """
+        Checks if the replica is not in its failure cool down.
+        """
+        return now >= self.down_until
+
+
+class HedgeRace:
+    """
+    The state shared by a hedged CHECK and its hedge.
+
+    Attributes:
+        done (threading.Event): Set once the first attempt returned.
+        sent (bool): Whether the hedge was sent before that.
+        hedged (threading.Event): Set once a sent hedge finished.
+        second (Optional[Replica]): The replica the hedge was sent to.
+        winner (Optional[Replica]): The replica whose answer is used.
+        result (Optional[dict]): The answer of the winner.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.sent = False
+        self.hedged = threading.Event()
+        self.second = None
+        self.winner = None
+        self.result = None
+
+    def start(self) -> bool:
+        """
+        Marks the hedge as sent unless the first attempt already returned.
+
+        Returns:
+            bool: True if the hedge may be sent.
+        """
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.sent = True
+            return True
+
+    def finish(self) -> bool:
+        """
+        Marks the first attempt as returned, so a pending hedge is not sent.
+
+        Returns:
+            bool: True if the hedge was sent already.
+        """
+        with self.lock:
+            self.done.set()
+            return self.sent
+
+    def claim(self, replica: Replica, result: dict) -> bool:
+        """
+        Records the answer of `replica` unless another one came first.
+
+        Returns:
+            bool: True if the answer is the one used.
+        """
+        with self.lock:
+            if self.winner is not None:
+                return False
+            self.winner = replica
+            self.result = result
+            return True
+
+
+class ClusterClient:
+    """
+    Wrapper for xmlrpc clients of all replicas.
+
+    Requests are spread over the replicas, either by the least number of
+    outstanding requests or by the observed latency. Unreachable replicas are
+    skipped for a cool down period, and CHECK requests can optionally be
+    hedged to a second replica when the first one is slow.
+    """
+
+    def __init__(
+        self,
+        addrs: List[str],
+        policy: str = POLICY_LEAST_OUTSTANDING,
+        pool_size: int = 4,
+        timeout: float = DEFAULT_TIMEOUT,
+        cooldown: float = 1.0,
+        hedge_delay: Optional[float] = None,
+    ) -> None:
+        """
+        Initializes a new instance of the ClusterClient class.
+
+        Args:
+        addrs (List[str]): The addresses of all replicas.
+        policy (str): "least_outstanding" or "latency".
+        pool_size (int): The number of idle connections kept per replica.
+        timeout (float): The socket timeout of a single rpc in seconds. It
+            must exceed the servers' request timeout plus a token hold, or a
+            write may be retried after the server committed it.
+        cooldown (float): How long an unreachable replica is skipped.
+        hedge_delay (Optional[float]): Delay after which a CHECK is sent to a
+            second replica as well. None disables hedging.
+
+        Returns:
+        None
+        """
+        if not addrs:
+            raise ValueError("ClusterClient needs at least one address")
+        if policy not in (POLICY_LEAST_OUTSTANDING, POLICY_LATENCY):
+            raise ValueError(f"Unknown policy {policy}")
+        self.replicas = [Replica(addr, timeout) for addr in addrs]
+        self.policy = policy
+        self.pool_size = pool_size
+        self.cooldown = cooldown
+        self.hedge_delay = hedge_delay
+        self.lock = threading.Lock()
+        # only hedges run here, first attempts run on the calling thread
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(addrs))
+
+    def _rank(self, exclude: List[Replica]) -> List[Replica]:
+        now = time.monotonic()
+        candidates = [r for r in self.replicas if r not in exclude]
+        up = [r for r in candidates if r.available(now)]
+        if not up:
+            # everybody failed recently, try the one that failed first
+            return sorted(candidates, key=lambda r: r.down_until)
+        if self.policy == POLICY_LATENCY:
+            return sorted(up, key=lambda r: r.latency * (r.outstanding + 1))
+        return sorted(up, key=lambda r: (r.outstanding, r.latency))
+
+    def _pick(self, exclude: List[Replica]) -> Optional[Replica]:
+        with self.lock:
+            ranked = self._rank(exclude)
+            if not ranked:
+                return None
+            replica = ranked[0]
+            replica.outstanding += 1
+            return replica
+
+    def _call(self, replica: Replica, method: str, *args, proxy=None):
+        """
+        Calls a rpc method on the given replica, which must have been picked.
+        A connection passed in as `proxy` stays with the caller.
+        """
+        owned = proxy is None
+        if owned:
+            proxy = replica.acquire()
+        start = time.monotonic()
+        try:
+            res = getattr(proxy, method)(*args)
+        except RETRYABLE_ERRORS:
+            with self.lock:
+                replica.outstanding -= 1
+                replica.down_until = time.monotonic() + self.cooldown
+            raise
+        except Exception:
+            with self.lock:
+                replica.outstanding -= 1
+            raise
+        elapsed = time.monotonic() - start
+        with self.lock:
+            replica.outstanding -= 1
+            replica.latency = (
+                elapsed if replica.latency == 0 else 0.8 * replica.latency + 0.2 * elapsed
+            )
+            replica.down_until = 0.0
+        if owned:
+            replica.release(proxy, self.pool_size)
+        return res
+
+    def _request_once(self, req: dict, exclude: List[Replica]) -> dict:
+        replica = self._pick(exclude)
+        if replica is None:
+            raise ConnectionError("ClusterClient: no replica reachable")
+        exclude.append(replica)
+        return self._call(replica, "request", req)
+
+    def _hedged_check(self, req: dict) -> dict:
+        # The first attempt runs on the calling thread, so a CHECK never
+        # waits for a free worker. A worker sends the hedge once the delay
+        # passed, and if it answers first it aborts the first attempt.
+        tried = []
+        first = self._pick(tried)
+        tried.append(first)
+        proxy = first.acquire()
+        race = HedgeRace()
+        deadline = time.monotonic() + self.hedge_delay
+        self.executor.submit(self._hedge, req, first, proxy, race, deadline)
+
+        start = time.monotonic()
+        try:
+            res = self._call(first, "request", req, proxy=proxy)
+            error = None
+        except RETRYABLE_ERRORS as e:
+            res, error = None, e
+        if res is not None and race.claim(first, res):
+            race.finish()
+            first.release(proxy, self.pool_size)
+            return self._shed(req, tried, res, True)
+
+        # the first attempt failed or lost, wait for the hedge if it was sent
+        if race.finish():
+            race.hedged.wait()
+        if race.winner is not None:
+            if error is not None:
+                elapsed = time.monotonic() - start
+                with self.lock:
+                    # it was only slow, the hedge cut it off
+                    first.down_until = 0.0
+                    first.latency = max(first.latency, elapsed)
+            tried.append(race.winner)
+            return self._shed(req, tried, race.result, True)
+        if race.second is not None:
+            tried.append(race.second)
+        # every hedged attempt failed, fall back to the remaining replicas
+        return self._failover(req, tried, error, True)
+
+    def _hedge(
+        self, req: dict, first: Replica, proxy: ServerProxy, race: HedgeRace, deadline: float
+    ) -> None:
+        if race.done.wait(max(0.0, deadline - time.monotonic())) or not race.start():
+            return
+        try:
+            second = self._pick([first])
+            if second is None:
+                return
+            race.second = second
+            try:
+                res = self._call(second, "request", req)
+            except RETRYABLE_ERRORS:
+                return
+            if race.claim(second, res):
+                proxy("transport").abort()
+        finally:
+            race.hedged.set()
+
+    def _failover(self, req: dict, tried: List[Replica], error, read_only: bool) -> dict:
+        """
+        Tries the remaining replicas. Writes only move on when the call was
+        rejected, because a timed out write may already have been applied.
+        """
+        while len(tried) < len(self.replicas):
+            try:
+                return self._request_once(req, tried)
+            except RETRYABLE_ERRORS as e:
+                if not read_only and not rejected(e):
+                    raise
+                error = e
+        raise ConnectionError(f"ClusterClient: all replicas failed: {error}")
+
+    def _shed(self, req: dict, tried: List[Replica], res: dict, read_only: bool) -> dict:
+        # A busy replica rejected the request before touching it, so any
+        # other replica may take it, reads and writes alike. A write that
+        # failed on the way to another replica may have been applied there,
+        # so only a rejected call lets it move on.
+        while res.get("status") == STATUS_BUSY and len(tried) < len(self.replicas):
+            try:
+                res = self._request_once(req, tried)
+            except RETRYABLE_ERRORS as e:
+                if not read_only and not rejected(e):
+                    raise
+        return res
+
+    def request(self, req: dict) -> dict:
+        """
+        Sends a request to one of the replicas and returns the response.
+
+        Reads fail over to the next replica on any connection error. Writes
+        only fail over when the call was rejected before the server handled
+        it, because a timed out write may already have been applied. Busy responses are retried on
+        the other replicas, and returned only if every replica is busy.
+
+        Args:
+        req (dict): The request to send.
+
+        Returns:
+        dict: The response from the server.
+        """
+        read_only = req.get("cmd") == "CHECK"
+        if read_only and self.hedge_delay is not None and len(self.replicas) > 1:
+            return self._hedged_check(req)
+
+        tried = []
+        try:
+            res = self._request_once(req, tried)
+        except RETRYABLE_ERRORS as e:
+            if not read_only and not rejected(e):
+                raise
+            res = self._failover(req, tried, e, read_only)
+        return self._shed(req, tried, res, read_only)
+
+    def dump(self) -> None:
+        """
+        Dumps the current state of every reachable replica.
+
+        Returns:
+        None
+        """
+        for replica in self.replicas:
+            with self.lock:
+                replica.outstanding += 1
+            try:
+                self._call(replica, "dump")
+            except RETRYABLE_ERRORS as e:
+                print(f"ClusterClient.dump() {replica.addr}: {e}")
+
+    def close(self) -> None:
+        """
+        Stops the hedging workers.
+
+        Returns:
+        None
+        """
+        self.executor.shutdown(wait=False)
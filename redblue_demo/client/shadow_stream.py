@@ -0,0 +1,158 @@
+"""
+This module contains the ShadowStream class, which sends the shadow
+operations for one peer in order from a single thread, optionally with delta
+encoded dependency clocks.
+"""
+
+import threading
+import time
+from queue import Empty, Queue
+from typing import Optional
+from xmlrpc.client import Fault, ServerProxy
+from redblue_demo.client.cluster_client import RETRYABLE_ERRORS, TimeoutTransport
+from redblue_demo.common.clock_delta import ClockEncoder
+from redblue_demo.common.common import FAULT_BUSY, SERVER_DELAY
+from redblue_demo.common.shadow_op import ShadowOp
+
+# Backoff bounds in seconds when the peer cannot take a shadow operation.
+MIN_BACKOFF: float = 0.05
+MAX_BACKOFF: float = 2.0
+# How long to wait for the peer to answer, in seconds.
+SEND_TIMEOUT: float = 10.0
+# How many shadow operations may wait for a peer before the server stops
+# taking writes, so that the peer can catch up.
+MAX_QUEUED: int = 100000
+# How often an idle sending thread checks whether the stream was closed.
+CLOSE_POLL: float = 0.5
+
+
+class ShadowStream:
+    """
+    An ordered stream of shadow operations to one peer.
+
+    A single thread sends the operations one after the other, retrying each
+    until the peer takes it, so a slow or unreachable peer holds one thread.
+    No operation is ever dropped; once MAX_QUEUED wait, the stream reports
+    itself backlogged and the server turns away new writes instead. With a sender ID every message
+    only carries the clock entries that changed since the previous one.
+    The peer keeps the connection alive between calls, so the stream stays
+    on one connection. Whenever the connection breaks, or the peer no longer
+    knows the stream, the stream starts over with the whole clock.
+
+    Attributes:
+        addr (str): The address of the peer.
+        encoder (Optional[ClockEncoder]): The clock encoder of the stream,
+            None if the messages carry whole clocks.
+        queue (Queue): The operations to send, with the time to send them at.
+        closed (threading.Event): Set once the stream stops sending.
+    """
+
+    def __init__(self, addr: str, sender: Optional[int] = None) -> None:
+        """
+        Starts the sending thread.
+
+        Args:
+            addr (str): The address of the peer.
+            sender (Optional[int]): The ID of the sending server, which turns
+                on delta encoded clocks.
+        """
+        self.addr = addr
+        self.encoder = ClockEncoder(sender) if sender is not None else None
+        self.queue = Queue()
+        self.closed = threading.Event()
+        self.rpc_client = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def put(self, op: ShadowOp) -> None:
+        """
+        Queues a shadow operation. It is sent SERVER_DELAY seconds later,
+        after every operation queued before it.
+
+        Args:
+            op (ShadowOp): The shadow operation.
+        """
+        if self.closed.is_set():
+            return
+        self.queue.put((time.monotonic() + SERVER_DELAY, op))
+
+    def backlogged(self) -> bool:
+        """
+        Checks if MAX_QUEUED or more operations wait for the peer.
+        """
+        return not self.closed.is_set() and self.queue.qsize() >= MAX_QUEUED
+
+    def flush(self) -> None:
+        """
+        Waits until every queued shadow operation is sent, or dropped by close.
+        """
+        self.queue.join()
+
+    def close(self) -> None:
+        """
+        Stops sending, and drops the operations still queued.
+        """
+        self.closed.set()
+
+    def _run(self) -> None:
+        while not self.closed.is_set():
+            try:
+                send_at, op = self.queue.get(timeout=CLOSE_POLL)
+            except Empty:
+                continue
+            delay = send_at - time.monotonic()
+            if delay > 0:
+                self.closed.wait(delay)
+            if not self.closed.is_set():
+                self._send(op)
+            self.queue.task_done()
+        # let flush return
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                return
+            self.queue.task_done()
+
+    def _reconnect(self) -> None:
+        # a new connection may reach another decode worker of the peer,
+        # which does not know the stream
+        self.rpc_client = ServerProxy(
+            self.addr, transport=TimeoutTransport(SEND_TIMEOUT), allow_none=True
+        )
+        if self.encoder is not None:
+            self.encoder.reset()
+
+    def _encode(self, op: ShadowOp):
+        return self.encoder.encode(op) if self.encoder is not None else op
+
+    def _call(self, msg) -> bool:
+        if self.encoder is None:
+            self.rpc_client.add_shadow_op(msg)
+            return True
+        return self.rpc_client.add_shadow_op_delta(msg)
+
+    def _send(self, op: ShadowOp) -> None:
+        if self.rpc_client is None:
+            self._reconnect()
+        msg = self._encode(op)
+        backoff = MIN_BACKOFF
+        while not self.closed.is_set():
+            try:
+                if self._call(msg):
+                    return
+                # the peer lost the stream, so start a new one
+                self.encoder.reset()
+                msg = self._encode(op)
+            except Fault as e:
+                if e.faultCode != FAULT_BUSY:
+                    print(f"client.AddShadowOp() : {e}")
+                    return
+                # the peer did not decode the message, so it can be resent
+                self.closed.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            except RETRYABLE_ERRORS:
+                # the receiver drops duplicates, so resending is safe
+                self.closed.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                self._reconnect()
+                msg = self._encode(op)
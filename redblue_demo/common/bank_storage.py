@@ -14,13 +14,15 @@ class BankStorage:
 
     Attributes:
         accounts (list): A list of Account objects representing the bank accounts.
+        num_accounts (int): The number of accounts.
     """
 
     accounts: list
 
-    def __init__(self) -> None:
+    def __init__(self, num_accounts: int = NUM_ACCOUNTS) -> None:
+        self.num_accounts = num_accounts
         self.accounts = []
-        for i in range(NUM_ACCOUNTS):
+        for i in range(num_accounts):
             self.accounts.append(Account(i, INIT_BALANCE))
 
     def get_account(self, aid: int) -> Account:
@@ -34,3 +36,29 @@ class BankStorage:
             Account: The Account object with the specified account ID.
         """
         return self.accounts[aid]
+
+    def export_balances(self) -> dict:
+        """
+        Returns the balances that differ from INIT_BALANCE.
+
+        Returns:
+            dict: A mapping from the account ID, as a string so that it can be
+                sent over xmlrpc, to the balance.
+        """
+        return {
+            str(account.aid): account.balance
+            for account in self.accounts
+            if account.balance != INIT_BALANCE
+        }
+
+    def import_balances(self, balances: dict) -> None:
+        """
+        Resets every account and loads balances exported by export_balances.
+
+        Args:
+            balances (dict): A mapping from the account ID to the balance.
+        """
+        for account in self.accounts:
+            account.set_balance(INIT_BALANCE)
+        for aid, balance in balances.items():
+            self.get_account(int(aid)).set_balance(balance)
@@ -0,0 +1,229 @@
+"""
+This module contains the delta encoding of shadow operation clocks on an
+ordered stream between two servers.
+
+Every message only carries the clock entries that changed since the previous
+message of the same stream. The first message of a stream, which the sender
+starts on every new connection or when the receiver lost track, is encoded
+against an empty clock and so carries the whole clock.
+
+A message is a list, which xmlrpc encodes much more compactly than a struct:
+
+    [sender, stream, seq, aid, server_id, amount, color, escrow, clock]
+
+where `clock` is a string "n;i:d,i:d,...;p:d,..." holding the length of `b`,
+then the changed entries of `b` and of `r` with their difference to the
+previous message.
+
+Shadow operations sent along with a clock, such as the ones riding on a red
+token, encode their clocks against that clock the same way.
+"""
+
+import random
+import threading
+from typing import List, Optional, Tuple
+
+from redblue_demo.common.common import COLOR
+from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.vector_clock import VectorClock
+
+
+def _diff(old: List[int], new: List[int]) -> str:
+    return ",".join(
+        f"{i}:{v - (old[i] if i < len(old) else 0)}"
+        for i, v in enumerate(new)
+        if i >= len(old) or old[i] != v
+    )
+
+
+def _patch(entries: List[int], diff: str) -> None:
+    if not diff:
+        return
+    for entry in diff.split(","):
+        i, d = entry.split(":")
+        i = int(i)
+        if i >= len(entries):
+            entries.extend([0] * (i + 1 - len(entries)))
+        entries[i] += int(d)
+
+
+def encode_clock(old: Optional[VectorClock], new: VectorClock) -> str:
+    """
+    Encodes a clock as the difference to a previous one.
+
+    Args:
+        old (Optional[VectorClock]): The previous clock, None for an empty one.
+        new (VectorClock): The clock to encode.
+
+    Returns:
+        str: The encoded clock.
+    """
+    old_b, old_r = (old.b, old.r) if old is not None else ([], [])
+    return f"{len(new.b)};{_diff(old_b, new.b)};{_diff(old_r, new.r)}"
+
+
+def decode_clock(b: List[int], r: List[int], clock: str) -> Tuple[List[int], List[int]]:
+    """
+    Applies an encoded clock to the entries of the previous clock in place.
+
+    Args:
+        b (List[int]): The blue entries of the previous clock.
+        r (List[int]): The red entries of the previous clock.
+        clock (str): The encoded clock.
+
+    Returns:
+        Tuple[List[int], List[int]]: The blue and red entries.
+    """
+    n, db, dr = clock.split(";")
+    n = int(n)
+    if n > len(b):
+        b.extend([0] * (n - len(b)))
+    else:
+        del b[n:]
+    _patch(b, db)
+    _patch(r, dr)
+    return b, r
+
+
+def encode_ops(clock: VectorClock, ops: List[ShadowOp]) -> list:
+    """
+    Encodes shadow operations with their clocks relative to `clock`.
+
+    Args:
+        clock (VectorClock): The clock sent along with the operations.
+        ops (List[ShadowOp]): The shadow operations.
+
+    Returns:
+        list: A [aid, server_id, amount, color, escrow, clock] list per operation.
+    """
+    return [
+        [op.aid, op.server_id, op.amount, op.color, op.escrow, encode_clock(clock, op.depend)]
+        for op in ops
+    ]
+
+
+def decode_ops(clock: dict, msgs: list) -> List[ShadowOp]:
+    """
+    Decodes shadow operations encoded by encode_ops.
+
+    Args:
+        clock (dict): The clock sent along with the operations.
+        msgs (list): The encoded operations.
+
+    Returns:
+        List[ShadowOp]: The shadow operations.
+    """
+    ops = []
+    for aid, server_id, amount, color, escrow, diff in msgs:
+        b, r = decode_clock(list(clock["b"]), list(clock["r"]), diff)
+        depend = VectorClock(len(b), len(r))
+        depend.b = b
+        depend.r = r
+        ops.append(
+            ShadowOp(aid, server_id, depend, amount, COLOR.RED if color else COLOR.BLUE, escrow)
+        )
+    return ops
+
+
+class ClockEncoder:
+    """
+    Encodes the shadow operations sent on one stream.
+
+    Attributes:
+        sender (int): The ID of the sending server.
+        stream (int): The ID of the current stream.
+        seq (int): The sequence number of the last message.
+        last (Optional[VectorClock]): The clock of the last message, None if
+            the next message must carry the whole clock.
+    """
+
+    def __init__(self, sender: int) -> None:
+        self.sender = sender
+        self.stream = 0
+        self.seq = 0
+        self.last = None
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Starts a new stream, whose first message carries the whole clock.
+        """
+        self.stream = random.randrange(1, 2**31)
+        self.seq = 0
+        self.last = None
+
+    def encode(self, op: ShadowOp) -> list:
+        """
+        Encodes a shadow operation as the next message of the stream.
+
+        Args:
+            op (ShadowOp): The shadow operation.
+
+        Returns:
+            list: The message.
+        """
+        self.seq += 1
+        clock = encode_clock(self.last, op.depend)
+        self.last = op.depend.copy()
+        return [
+            self.sender,
+            self.stream,
+            self.seq,
+            op.aid,
+            op.server_id,
+            op.amount,
+            op.color,
+            op.escrow,
+            clock,
+        ]
+
+
+class ClockDecoder:
+    """
+    Decodes the messages of the streams of every sender.
+
+    Attributes:
+        streams (dict): A mapping from the sender ID to the stream ID, the
+            last sequence number and the last clock of its current stream.
+    """
+
+    streams: dict
+
+    def __init__(self) -> None:
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def decode(self, msg: list) -> Optional[ShadowOp]:
+        """
+        Decodes the next message of a stream.
+
+        Args:
+            msg (list): The message.
+
+        Returns:
+            Optional[ShadowOp]: The shadow operation, or None if the message
+                does not follow the last one of its stream and the sender has
+                to start a new stream.
+        """
+        sender, stream, seq, aid, server_id, amount, color, escrow, clock = msg
+        with self.lock:
+            if seq == 1:
+                state = {"stream": stream, "b": [], "r": []}
+                self.streams[sender] = state
+            else:
+                state = self.streams.get(sender)
+                if state is None or state["stream"] != stream or state["seq"] + 1 != seq:
+                    return None
+            state["seq"] = seq
+            b, r = decode_clock(state["b"], state["r"], clock)
+            depend = VectorClock(len(b), len(r))
+            depend.b = list(b)
+            depend.r = list(r)
+        return ShadowOp(
+            aid,
+            server_id,
+            depend,
+            amount,
+            COLOR.BLUE if color == 0 else COLOR.RED,
+            escrow,
+        )
@@ -8,6 +8,12 @@ Classes:
 Constants:
 - INTEREST_RATE: The interest rate used for calculations.
 - SERVER_DELAY: The delay time for server responses.
+- TOKEN_HOLD: How long a server holds the red token.
+- REQUEST_TIMEOUT: The default deadline of a client request on the server.
+- STATUS_BUSY: Response status of a request rejected by admission control.
+- STATUS_TIMEOUT: Response status of a request that missed its deadline.
+- FAULT_BUSY: Fault code of a shadow operation rejected by admission control.
+- HTTP_BUSY: HTTP status of a connection rejected by admission control.
 
 Enums:
 - COLOR: Represents colors.
@@ -19,6 +25,13 @@ from typing import Optional
 
 INTEREST_RATE: float = 0.04
 SERVER_DELAY: float = 0.2
+TOKEN_HOLD: float = 1.0
+REQUEST_TIMEOUT: float = 10.0
+
+STATUS_BUSY: int = -2
+STATUS_TIMEOUT: int = -3
+FAULT_BUSY: int = 429
+HTTP_BUSY: int = 503
 
 
 class COLOR:
@@ -60,6 +73,30 @@ class Request:
         self.op: REQ = op
         self.amount: float = amount
 
+    @classmethod
+    def from_dict(cls, data: dict) -> Optional["Request"]:
+        """
+        Creates a Request instance from the dictionary a client sends.
+
+        Args:
+            data (dict): The command, account ID and, for deposits and
+                withdrawals, the amount.
+
+        Returns:
+            Optional[Request]: The request, or None if it is malformed.
+        """
+        if len(data) == 3:
+            if data["cmd"] == "DEPOSIT":
+                return cls(data["aid"], REQ.DEPOSIT, data["amount"])
+            if data["cmd"] == "WITHDRAW":
+                return cls(data["aid"], REQ.WITHDRAW, data["amount"])
+        elif len(data) == 2:
+            if data["cmd"] == "INTEREST":
+                return cls(data["aid"], REQ.INTEREST)
+            if data["cmd"] == "CHECK":
+                return cls(data["aid"], REQ.CHECK)
+        return None
+
 
 class Response:
     """
@@ -69,14 +106,31 @@ class Response:
     - status: The status code of the response.
     - balance: The account balance associated with the response.
     - message: An optional message accompanying the response.
+    - retry_after: Seconds after which a rejected request may be retried.
     """
 
     def __init__(
-        self, status: int, balance: float = 0, message: Optional[str] = ""
+        self,
+        status: int,
+        balance: float = 0,
+        message: Optional[str] = "",
+        retry_after: float = 0,
     ) -> None:
         self.status: int = status
         self.balance: float = balance
         self.message: str = message
+        self.retry_after: float = retry_after
+
+    def to_dict(self) -> dict:
+        """
+        Returns the dictionary sent back to the client.
+        """
+        return {
+            "status": self.status,
+            "balance": self.balance,
+            "message": self.message,
+            "retry_after": self.retry_after,
+        }
 
     def print(self) -> None:
         """
@@ -85,4 +139,6 @@ class Response:
         print(f"status {self.status}, balance {self.balance:.2f}", end="")
         if self.message:
             print(f", message: {self.message}", end="")
+        if self.retry_after:
+            print(f", retry after {self.retry_after:.2f}s", end="")
         print()
@@ -0,0 +1,110 @@
+"""
+This module contains the EscrowTable class, which tracks how much of every
+account balance each server may spend on its own.
+"""
+
+from redblue_demo.common.bank_storage import INIT_BALANCE
+
+
+class EscrowTable:
+    """
+    Tracks the escrow share of every server for every account.
+
+    Only the owner of a share ever decreases it, so a server can spend its
+    own share without coordination. Whatever part of a balance is not in
+    any share is the pool, which only red operations spend.
+
+    Attributes:
+        num_initial (int): The number of servers the initial balances are
+            split between.
+        shares (dict): A mapping from the account ID to the list of shares of
+            accounts whose shares differ from the initial split.
+    """
+
+    shares: dict
+
+    def __init__(self, num_initial: int) -> None:
+        """
+        Initializes the table with INIT_BALANCE split evenly between the
+        first `num_initial` servers.
+
+        Args:
+            num_initial (int): The number of servers at startup.
+        """
+        self.num_initial = num_initial
+        self.shares = {}
+
+    def _initial(self, server_id: int) -> float:
+        return INIT_BALANCE / self.num_initial if server_id < self.num_initial else 0.0
+
+    def share(self, aid: int, server_id: int) -> float:
+        """
+        Returns the share of a server for an account.
+
+        Args:
+            aid (int): The account ID.
+            server_id (int): The server ID.
+
+        Returns:
+            float: The share.
+        """
+        shares = self.shares.get(aid)
+        if shares is None:
+            return self._initial(server_id)
+        return shares[server_id] if server_id < len(shares) else 0.0
+
+    def total(self, aid: int) -> float:
+        """
+        Returns the sum of the shares of all servers for an account.
+
+        Args:
+            aid (int): The account ID.
+
+        Returns:
+            float: The escrowed part of the balance.
+        """
+        shares = self.shares.get(aid)
+        if shares is None:
+            return INIT_BALANCE
+        return sum(shares)
+
+    def add(self, aid: int, server_id: int, delta: float) -> None:
+        """
+        Changes the share of a server for an account.
+
+        Args:
+            aid (int): The account ID.
+            server_id (int): The server ID.
+            delta (float): The change of the share.
+        """
+        if delta == 0:
+            return
+        shares = self.shares.get(aid)
+        if shares is None:
+            shares = [self._initial(i) for i in range(self.num_initial)]
+            self.shares[aid] = shares
+        if server_id >= len(shares):
+            shares.extend([0.0] * (server_id + 1 - len(shares)))
+        shares[server_id] += delta
+
+    def export_shares(self) -> dict:
+        """
+        Returns the table in a form that can be sent over xmlrpc.
+
+        Returns:
+            dict: The number of initial servers and the changed shares.
+        """
+        return {
+            "num_initial": self.num_initial,
+            "shares": {str(aid): shares for aid, shares in self.shares.items()},
+        }
+
+    def import_shares(self, data: dict) -> None:
+        """
+        Replaces the table with one exported by export_shares.
+
+        Args:
+            data (dict): The exported table.
+        """
+        self.num_initial = data["num_initial"]
+        self.shares = {int(aid): list(shares) for aid, shares in data["shares"].items()}
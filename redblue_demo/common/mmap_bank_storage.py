@@ -0,0 +1,224 @@
+"""
+This module provides a bank storage backed by a memory-mapped balance file.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+from typing import Optional
+
+from redblue_demo.common.account import Account
+from redblue_demo.common.bank_storage import INIT_BALANCE, NUM_ACCOUNTS, BankStorage
+
+MAGIC = b"RBBAL001"
+HEADER = struct.Struct("<8sQ")
+WORD = struct.Struct("<Q")
+
+# export_balances compares the file with zeros in chunks of this many bytes,
+# and only looks at the words of chunks that differ.
+SCAN_CHUNK = 4096
+ZERO_CHUNK = bytes(SCAN_CHUNK)
+
+# Balances are stored xor-ed with the bits of INIT_BALANCE, so that a zero
+# filled file, which the file system creates without writing it, holds
+# INIT_BALANCE in every account and values still round trip exactly.
+INIT_BITS = struct.unpack("<Q", struct.pack("<d", INIT_BALANCE))[0]
+
+
+def _to_bits(balance: float) -> int:
+    return struct.unpack("<Q", struct.pack("<d", balance))[0] ^ INIT_BITS
+
+
+def _from_bits(bits: int) -> float:
+    return struct.unpack("<d", struct.pack("<Q", bits ^ INIT_BITS))[0]
+
+
+class MappedAccount(Account):
+    """
+    Represents a bank account whose balance lives in a MmapBankStorage.
+    Reading and writing `balance` goes straight to the mapped file.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, storage: "MmapBankStorage", aid: int) -> None:
+        self.storage = storage
+        self.aid = aid
+
+    @property
+    def balance(self) -> float:
+        return _from_bits(self.storage.words[self.aid])
+
+    @balance.setter
+    def balance(self, balance: float) -> None:
+        words = self.storage.words
+        undo = self.storage.undo
+        if undo is not None and self.aid not in undo:
+            undo[self.aid] = words[self.aid]
+        words[self.aid] = _to_bits(balance)
+
+
+class MmapBankStorage(BankStorage):
+    """
+    A bank storage over a memory-mapped file of fixed-width balances.
+
+    Opening the file takes constant time whatever the number of accounts,
+    and only the pages of accessed accounts are ever read.
+
+    Attributes:
+        path (str): The path of the balance file.
+        num_accounts (int): The number of accounts.
+        words (memoryview): The balances as 64 bit words.
+        undo (Optional[dict]): While a checkpoint is copied, the words as
+            they were when it began, of every account written since.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(
+        self, path: str, num_accounts: int = NUM_ACCOUNTS, reset: bool = False
+    ) -> None:
+        """
+        Opens the balance file, creating it if it does not exist.
+
+        Args:
+            path (str): The path of the balance file.
+            num_accounts (int): The number of accounts of a new file.
+            reset (bool): Whether to set every balance back to INIT_BALANCE.
+        """
+        self.path = path
+        self.undo = None
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")  # pylint: disable=consider-using-with
+        if exists and not reset:
+            magic, num_accounts = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a balance file")
+        else:
+            self._format(num_accounts)
+        self.num_accounts = num_accounts
+        self._map()
+
+    def _format(self, num_accounts: int) -> None:
+        self.file.seek(0)
+        self.file.truncate(0)
+        self.file.write(HEADER.pack(MAGIC, num_accounts))
+        # extending the file fills it with zeros without writing them
+        self.file.truncate(HEADER.size + 8 * num_accounts)
+        self.file.flush()
+
+    def _map(self) -> None:
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.words = memoryview(self.mm)[HEADER.size :].cast("Q")
+
+    def _unmap(self) -> None:
+        self.words.release()
+        self.mm.close()
+
+    def get_account(self, aid: int) -> Account:
+        """
+        Returns a view of the account with the specified account ID.
+
+        Args:
+            aid (int): The account ID.
+
+        Returns:
+            Account: The account, whose balance reads and writes the file.
+        """
+        if aid < 0 or aid >= self.num_accounts:
+            raise IndexError(f"account {aid} out of range")
+        return MappedAccount(self, aid)
+
+    def export_balances(self) -> dict:
+        """
+        Returns the balances that differ from INIT_BALANCE.
+
+        Returns:
+            dict: A mapping from the account ID, as a string, to the balance.
+        """
+        balances = {}
+        size = 8 * self.num_accounts
+        for start in range(0, size, SCAN_CHUNK):
+            end = min(start + SCAN_CHUNK, size)
+            chunk = self.mm[HEADER.size + start : HEADER.size + end]
+            # most chunks of a large file were never written
+            if chunk == ZERO_CHUNK[: end - start]:
+                continue
+            for aid in range(start // 8, end // 8):
+                bits = self.words[aid]
+                if bits:
+                    balances[str(aid)] = _from_bits(bits)
+        return balances
+
+    def import_balances(self, balances: dict) -> None:
+        """
+        Resets every account and loads balances exported by export_balances.
+
+        Args:
+            balances (dict): A mapping from the account ID to the balance.
+        """
+        self._unmap()
+        self._format(self.num_accounts)
+        self._map()
+        for aid, balance in balances.items():
+            self.get_account(int(aid)).set_balance(balance)
+
+    def flush(self) -> None:
+        """
+        Writes the changed pages back to the file.
+        """
+        self.mm.flush()
+
+    def checkpoint(self, dest: str) -> None:
+        """
+        Copies the balance file to `dest`. The file must not change meanwhile.
+
+        Args:
+            dest (str): The path of the copy.
+        """
+        self.begin_checkpoint()
+        self.copy_to(dest)
+        self.end_checkpoint(dest)
+
+    def begin_checkpoint(self) -> None:
+        """
+        Freezes the balances as of now for a copy that is taken while they
+        keep changing: every account written from here on keeps its current
+        word in `undo` until end_checkpoint.
+        """
+        self.undo = {}
+
+    def copy_to(self, dest: str) -> None:
+        """
+        Copies the balance file to `dest`. May run on another thread between
+        begin_checkpoint and end_checkpoint. Reads of the file see the
+        mapped pages, written back or not.
+
+        Args:
+            dest (str): The path of the copy.
+        """
+        shutil.copyfile(self.path, dest)
+
+    def end_checkpoint(self, dest: Optional[str]) -> None:
+        """
+        Stops recording, and writes the frozen words of the accounts written
+        since begin_checkpoint into the copy, which then holds the balances
+        as of begin_checkpoint.
+
+        Args:
+            dest (Optional[str]): The path of the copy, None if it failed.
+        """
+        undo, self.undo = self.undo, None
+        if dest is None:
+            return
+        with open(dest, "r+b") as f:
+            for aid in sorted(undo):
+                f.seek(HEADER.size + 8 * aid)
+                f.write(WORD.pack(undo[aid]))
+
+    def close(self) -> None:
+        """
+        Flushes and closes the balance file.
+        """
+        self.flush()
+        self._unmap()
+        self.file.close()
@@ -0,0 +1,138 @@
+"""
+This module contains a compact binary log of shadow operations, used to
+record the operation stream of a live server and replay it offline.
+"""
+
+import struct
+from typing import Iterator, Tuple
+
+from redblue_demo.common.common import COLOR
+from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.vector_clock import VectorClock
+
+MAGIC = b"RBOPLOG2"
+# the length of the dependency mode name, which follows
+MODE = struct.Struct("<B")
+# local flag, color, origin server, account, amount, escrow, clock widths
+RECORD = struct.Struct("<BBHqddHH")
+
+
+class OpLogWriter:
+    """
+    Appends shadow operations to an operation log.
+
+    Attributes:
+        path (str): The path of the log.
+        dirty (bool): Whether records were written since the last flush.
+    """
+
+    def __init__(self, path: str, dependency: str) -> None:
+        """
+        Creates the log, replacing an existing one.
+
+        Args:
+            path (str): The path of the log.
+            dependency (str): The dependency mode of the recorded clocks,
+                which a replay has to use too.
+        """
+        self.path = path
+        self.file = open(path, "wb")  # pylint: disable=consider-using-with
+        mode = dependency.encode()
+        self.file.write(MAGIC + MODE.pack(len(mode)) + mode)
+        self.dirty = False
+
+    def write(self, op: ShadowOp, local: bool) -> None:
+        """
+        Appends a shadow operation.
+
+        Args:
+            op (ShadowOp): The shadow operation.
+            local (bool): Whether the server generated the operation itself.
+        """
+        b = op.depend.b
+        r = op.depend.r
+        self.file.write(
+            RECORD.pack(
+                local,
+                op.color,
+                op.server_id,
+                op.aid,
+                op.amount,
+                op.escrow,
+                len(b),
+                len(r),
+            )
+        )
+        self.file.write(struct.pack(f"<{len(b) + len(r)}I", *b, *r))
+        self.dirty = True
+
+    def flush(self) -> None:
+        """
+        Writes buffered records to the file.
+        """
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+    def close(self) -> None:
+        """
+        Flushes and closes the log.
+        """
+        self.flush()
+        self.file.close()
+
+
+def _read_header(data: bytes, path: str) -> Tuple[str, int]:
+    if data[: len(MAGIC)] != MAGIC or len(data) < len(MAGIC) + MODE.size:
+        raise ValueError(f"{path} is not an operation log")
+    offset = len(MAGIC) + MODE.size
+    (size,) = MODE.unpack_from(data, len(MAGIC))
+    return data[offset : offset + size].decode(), offset + size
+
+
+def read_op_log_dependency(path: str) -> str:
+    """
+    Returns the dependency mode an operation log was recorded with.
+
+    Args:
+        path (str): The path of the log.
+
+    Returns:
+        str: The dependency mode.
+    """
+    with open(path, "rb") as f:
+        data = f.read(len(MAGIC) + MODE.size + 255)
+    return _read_header(data, path)[0]
+
+
+def read_op_log(path: str) -> Iterator[Tuple[bool, ShadowOp]]:
+    """
+    Reads the shadow operations of an operation log in recorded order.
+
+    Args:
+        path (str): The path of the log.
+
+    Returns:
+        Iterator[Tuple[bool, ShadowOp]]: The local flag and the operation of
+            every record. A truncated last record is ignored.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    _, offset = _read_header(data, path)
+    while offset + RECORD.size <= len(data):
+        local, color, server_id, aid, amount, escrow, nb, nr = RECORD.unpack_from(
+            data, offset
+        )
+        offset += RECORD.size
+        clock = struct.Struct(f"<{nb + nr}I")
+        if offset + clock.size > len(data):
+            return
+        values = clock.unpack_from(data, offset)
+        offset += clock.size
+
+        depend = VectorClock(nb, nr)
+        depend.b = list(values[:nb])
+        depend.r = list(values[nb:])
+        op = ShadowOp(aid, server_id, depend, amount, COLOR.RED if color else COLOR.BLUE)
+        op.escrow = escrow
+        yield bool(local), op
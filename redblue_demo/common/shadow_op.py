@@ -19,6 +19,7 @@ class ShadowOp:
             dependencies of the shadow operation.
         amount (float): The amount to be applied to the account balance.
         color (COLOR): The color of the shadow operation.
+        escrow (float): The change of the origin server's escrow share.
     """
 
     def __init__(
@@ -28,12 +29,14 @@ class ShadowOp:
         depend: VectorClock,
         amount: float = 0,
         color: COLOR = COLOR.BLUE,
+        escrow: float = 0,
     ) -> None:
         self.aid = aid
         self.server_id = server_id
         self.depend = depend
         self.amount = amount
         self.color = color
+        self.escrow = escrow
 
     def apply(self, bank: BankStorage) -> None:
         """
@@ -61,13 +64,17 @@ class ShadowOp:
             ShadowOp: The created ShadowOp instance.
 
         """
+        red = data["depend"]["r"]
+        if isinstance(red, int):
+            red = [red]
         shadow_op = cls(
             data["aid"],
             data["server_id"],
-            VectorClock(len(data["depend"]["b"])),
+            VectorClock(len(data["depend"]["b"]), len(red)),
             data["amount"],
         )
         shadow_op.depend.b = data["depend"]["b"]
-        shadow_op.depend.r = data["depend"]["r"]
+        shadow_op.depend.r = red
         shadow_op.color = COLOR.BLUE if data["color"] == 0 else COLOR.RED
+        shadow_op.escrow = data.get("escrow", 0)
         return shadow_op
@@ -0,0 +1,102 @@
+"""
+This module contains the ShmRing class, a ring buffer of fixed-size records
+in shared memory that passes records from one process to another.
+"""
+
+from multiprocessing import shared_memory
+from typing import Optional
+
+# The head and the tail counters live on separate cache lines.
+HEAD = 0
+TAIL = 8
+DATA_OFFSET = 128
+
+
+class ShmRing:
+    """
+    A single-producer single-consumer ring buffer in shared memory.
+
+    Only the producer advances the tail and only the consumer advances the
+    head, so neither needs a lock across processes. Several threads of one
+    process must take turns to produce or to consume.
+
+    Attributes:
+        record_size (int): The size of every record in bytes.
+        capacity (int): The number of records the ring holds.
+        name (str): The name of the shared memory block.
+    """
+
+    def __init__(self, record_size: int, capacity: int, name: Optional[str] = None) -> None:
+        """
+        Creates a new ring, or attaches to the ring named `name`.
+
+        Args:
+            record_size (int): The size of every record in bytes.
+            capacity (int): The number of records the ring holds.
+            name (Optional[str]): The name of an existing ring to attach to.
+        """
+        self.record_size = record_size
+        self.capacity = capacity
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=DATA_OFFSET + record_size * capacity
+            )
+        else:
+            # attaching from a process started by multiprocessing shares the
+            # creator's resource tracker, which removes the block once the
+            # creator exits, even if it is killed
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.counters = self.buf[:DATA_OFFSET].cast("Q")
+
+    def full(self) -> bool:
+        """
+        Returns whether the ring has no free slot.
+        """
+        return self.counters[TAIL] - self.counters[HEAD] >= self.capacity
+
+    def push(self, record: bytes) -> bool:
+        """
+        Appends a record. Called by the producer only.
+
+        Args:
+            record (bytes): The record, exactly `record_size` bytes long.
+
+        Returns:
+            bool: False if the ring is full.
+        """
+        tail = self.counters[TAIL]
+        if tail - self.counters[HEAD] >= self.capacity:
+            return False
+        offset = DATA_OFFSET + (tail % self.capacity) * self.record_size
+        self.buf[offset : offset + self.record_size] = record
+        # publish the record only after it is written
+        self.counters[TAIL] = tail + 1
+        return True
+
+    def pop(self) -> Optional[bytes]:
+        """
+        Removes the oldest record. Called by the consumer only.
+
+        Returns:
+            Optional[bytes]: The record, or None if the ring is empty.
+        """
+        head = self.counters[HEAD]
+        if head == self.counters[TAIL]:
+            return None
+        offset = DATA_OFFSET + (head % self.capacity) * self.record_size
+        record = bytes(self.buf[offset : offset + self.record_size])
+        self.counters[HEAD] = head + 1
+        return record
+
+    def close(self) -> None:
+        """
+        Detaches from the ring, and removes it if this process created it.
+        """
+        self.counters.release()
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
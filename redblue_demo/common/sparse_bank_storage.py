@@ -0,0 +1,84 @@
+"""
+This module provides a bank storage that only keeps accounts whose balance
+differs from INIT_BALANCE.
+"""
+
+from redblue_demo.common.account import Account
+from redblue_demo.common.bank_storage import INIT_BALANCE, NUM_ACCOUNTS, BankStorage
+
+
+class SparseAccount(Account):
+    """
+    Represents a bank account whose balance lives in a SparseBankStorage.
+    Setting the balance back to INIT_BALANCE drops the account from storage.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, storage: "SparseBankStorage", aid: int) -> None:
+        self.storage = storage
+        self.aid = aid
+
+    @property
+    def balance(self) -> float:
+        return self.storage.balances.get(self.aid, INIT_BALANCE)
+
+    @balance.setter
+    def balance(self, balance: float) -> None:
+        if balance == INIT_BALANCE:
+            self.storage.balances.pop(self.aid, None)
+        else:
+            self.storage.balances[self.aid] = balance
+
+
+class SparseBankStorage(BankStorage):
+    """
+    A bank storage for very large, mostly idle account spaces.
+    Memory grows with the number of accounts that were ever changed,
+    not with the size of the account space.
+
+    Attributes:
+        balances (dict): A mapping from the account ID to the balance of
+            accounts whose balance differs from INIT_BALANCE.
+        num_accounts (int): The number of accounts.
+    """
+
+    balances: dict
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, num_accounts: int = NUM_ACCOUNTS) -> None:
+        self.num_accounts = num_accounts
+        self.balances = {}
+
+    def get_account(self, aid: int) -> Account:
+        """
+        Returns a view of the account with the specified account ID.
+
+        Args:
+            aid (int): The account ID.
+
+        Returns:
+            Account: The account, whose balance reads and writes the storage.
+        """
+        if aid < 0 or aid >= self.num_accounts:
+            raise IndexError(f"account {aid} out of range")
+        return SparseAccount(self, aid)
+
+    def export_balances(self) -> dict:
+        """
+        Returns the balances that differ from INIT_BALANCE.
+
+        Returns:
+            dict: A mapping from the account ID, as a string, to the balance.
+        """
+        return {str(aid): balance for aid, balance in self.balances.items()}
+
+    def import_balances(self, balances: dict) -> None:
+        """
+        Resets every account and loads balances exported by export_balances.
+
+        Args:
+            balances (dict): A mapping from the account ID to the balance.
+        """
+        self.balances = {}
+        for aid, balance in balances.items():
+            self.get_account(int(aid)).set_balance(balance)
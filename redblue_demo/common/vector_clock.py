@@ -11,24 +11,26 @@ class VectorClock:
 
     Attributes:
         b (list): A list of integers representing the clock values for each server.
-        r (int): An integer representing the red clock value.
+        r (list): A list of integers representing the red clock value of
+            each red token partition.
     """
 
     b: list
-    r: int
+    r: list
 
-    def __init__(self, num_server: int) -> None:
+    def __init__(self, num_server: int, num_partitions: int = 1) -> None:
         """
         Initializes the vector clock with the given number of servers.
 
         Args:
             num_server (int): The number of servers.
+            num_partitions (int): The number of red token partitions.
 
         Returns:
             None
         """
         self.b = [0] * num_server
-        self.r = 0
+        self.r = [0] * num_partitions
 
     def ready(self, now: "VectorClock") -> bool:
         """
@@ -40,11 +42,15 @@ class VectorClock:
         Returns:
             bool: True if the current clock is ready, False otherwise.
         """
-        for i, bi in enumerate(now.b):
-            if self.b[i] > bi:
+        for i, bi in enumerate(self.b):
+            if i >= len(now.b):
+                if bi > 0:
+                    return False
+            elif bi > now.b[i]:
+                return False
+        for p, rp in enumerate(self.r):
+            if rp > now.r[p]:
                 return False
-        if self.r > now.r:
-            return False
         return True
 
     def copy(self) -> "VectorClock":
@@ -55,27 +61,45 @@ class VectorClock:
             VectorClock: A copy of the vector clock.
         """
         b = [self.b[i] for i in range(len(self.b))]
-        vector_clock = VectorClock(len(self.b))
+        vector_clock = VectorClock(len(self.b), len(self.r))
         vector_clock.b = b
-        vector_clock.r = self.r
+        vector_clock.r = list(self.r)
         return vector_clock
 
-    def red(self) -> int:
+    def resize(self, num_server: int) -> None:
+        """
+        Grows the clock to the given number of servers.
+        Entries of new servers start at zero, and the clock never shrinks.
+
+        Args:
+            num_server (int): The number of servers.
+
+        Returns:
+            None
+        """
+        if num_server > len(self.b):
+            self.b.extend([0] * (num_server - len(self.b)))
+
+    def red(self, partition: int = 0) -> int:
         """
         Returns the red clock value.
 
+        Args:
+            partition (int): The red token partition.
+
         Returns:
             int: The red clock value.
         """
-        return self.r
+        return self.r[partition]
 
-    def tick(self, server_id: int, color: COLOR) -> "VectorClock":
+    def tick(self, server_id: int, color: COLOR, partition: int = 0) -> "VectorClock":
         """
         Updates the clock values based on the server ID and color.
 
         Args:
             server_id (int): The ID of the server.
             color (COLOR): The color of the clock tick.
+            partition (int): The red token partition of a red tick.
 
         Returns:
             VectorClock: The previous state of the vector clock.
@@ -83,7 +107,7 @@ class VectorClock:
         old = self.copy()
         self.b[server_id] = self.b[server_id] + 1
         if color == COLOR.RED:
-            self.r = self.r + 1
+            self.r[partition] = self.r[partition] + 1
         return old
 
     def print(self, server_id: int) -> None:
@@ -99,4 +123,7 @@ class VectorClock:
         print(f"#{server_id} [", end="")
         for _, bi in enumerate(self.b):
             print(f" {bi}", end="")
-        print(f" ; {self.r} ]")
+        print(" ;", end="")
+        for _, rp in enumerate(self.r):
+            print(f" {rp}", end="")
+        print(" ]")
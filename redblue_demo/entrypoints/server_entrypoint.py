@@ -1,11 +1,15 @@
 """
 This module contains the entry point for running the server.
 
-It defines the `main` function which parses the command line arguments, 
+It defines the `main` function which parses the command line arguments,
 creates a `Server` instance, and runs the server.
 """
 
+import argparse
 import sys
+from redblue_demo.common.bank_storage import NUM_ACCOUNTS
+from redblue_demo.common.common import REQUEST_TIMEOUT
+from redblue_demo.server.rpc_handler import MAX_CONNECTIONS
 from redblue_demo.server.server import Server, ServerConfig
 
 
@@ -13,10 +17,77 @@ def usage():
     """
     Prints the usage information and exits the program.
     """
-    print("Usage: python server.py index addr1 addr2 ...")
+    print("Usage: python server.py index addr1 addr2 ... [options]")
+    print("       python server.py join member_addr own_addr [options]")
     sys.exit("Wrong command line argument")
 
 
+def parse_args(args):
+    """
+    Parses the command line arguments into a ServerConfig.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("index")
+    parser.add_argument("addr", nargs="+")
+    parser.add_argument("--max-requests", type=int, default=1024)
+    parser.add_argument("--max-red", type=int, default=256)
+    parser.add_argument("--max-shadow", type=int, default=4096)
+    parser.add_argument("--request-timeout", type=float, default=REQUEST_TIMEOUT)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--dissemination", choices=["direct", "tree"], default="direct")
+    parser.add_argument("--fanout", type=int, default=2)
+    parser.add_argument("--op-log-size", type=int, default=10000)
+    parser.add_argument("--partitions", type=int, default=1)
+    parser.add_argument("--escrow", action="store_true")
+    parser.add_argument("--storage")
+    parser.add_argument("--sparse", action="store_true")
+    parser.add_argument("--num-accounts", type=int, default=NUM_ACCOUNTS)
+    parser.add_argument("--record")
+    parser.add_argument("--dependency", choices=["full", "account"], default="full")
+    parser.add_argument("--delta-clocks", action="store_true")
+    parser.add_argument("--decode-workers", type=int, default=0)
+    parser.add_argument("--token-ops", type=int, default=32)
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument("--restore")
+    try:
+        ns = parser.parse_args(args)
+        join = None
+        if ns.index == "join":
+            if len(ns.addr) != 2:
+                usage()
+            join, ns.addr = ns.addr[0], ns.addr[1:]
+            index = -1
+        else:
+            index = int(ns.index, 16)
+    except (SystemExit, ValueError):
+        usage()
+    return ServerConfig(
+        index,
+        ns.addr,
+        max_requests=ns.max_requests,
+        max_red=ns.max_red,
+        max_shadow=ns.max_shadow,
+        request_timeout=ns.request_timeout,
+        retry_after=ns.retry_after,
+        dissemination=ns.dissemination,
+        fanout=ns.fanout,
+        join=join,
+        op_log_size=ns.op_log_size,
+        num_partitions=ns.partitions,
+        escrow=ns.escrow,
+        storage_path=ns.storage,
+        sparse_storage=ns.sparse,
+        num_accounts=ns.num_accounts,
+        record_path=ns.record,
+        dependency=ns.dependency,
+        delta_clocks=ns.delta_clocks,
+        decode_workers=ns.decode_workers,
+        token_ops=ns.token_ops,
+        max_connections=ns.max_connections,
+        restore_path=ns.restore,
+    )
+
+
 def main():
     """
     Parses the command line arguments, creates a Server instance, and runs the server.
@@ -24,12 +95,7 @@ def main():
     args = sys.argv[1:]
     if len(args) < 2:
         usage()
-    try:
-        index = int(args[0], 16)
-    except ValueError:
-        usage()
-    addr = args[1:]
-    server = Server.from_config(ServerConfig(index, addr))
+    server = Server.from_config(parse_args(args))
     server.run()
 
 
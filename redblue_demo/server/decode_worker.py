@@ -0,0 +1,447 @@
+"""
+This module contains the decode workers, which take network I/O and xmlrpc
+decoding off the process that applies operations.
+
+Every worker is a process serving the public address of the server, which
+all workers share with SO_REUSEPORT. It decodes client requests and shadow
+operations, as well as red tokens and the operations riding along with
+them, and hands them to the apply process as fixed-layout binary records
+through shared memory rings, and gets the responses back the same way.
+Every other call is forwarded to the apply process over loopback.
+"""
+
+import itertools
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from queue import Empty, Queue
+from typing import List, Optional, Tuple
+from xmlrpc.client import Fault, ServerProxy
+from xmlrpc.server import SimpleXMLRPCServer
+
+from redblue_demo.common.clock_delta import ClockDecoder, decode_ops
+from redblue_demo.common.common import (
+    COLOR,
+    FAULT_BUSY,
+    REQ,
+    STATUS_BUSY,
+    STATUS_TIMEOUT,
+    TOKEN_HOLD,
+    Request,
+    Response,
+)
+from redblue_demo.common.shadow_op import ShadowOp
+from redblue_demo.common.shm_ring import ShmRing
+from redblue_demo.common.vector_clock import VectorClock
+from redblue_demo.server.rpc_handler import BoundedThreadingMixIn, KeepAliveRequestHandler
+
+# The largest clock, blue and red entries together, a record can hold.
+MAX_CLOCK = 64
+
+# request id, request type (0 if malformed), account, amount, deadline
+REQUEST = struct.Struct("<IBqdd")
+# color, origin server, account, amount, escrow, clock widths, clock entries
+SHADOW = struct.Struct(f"<BHqddHH{MAX_CLOCK}I")
+# request id, status, balance, retry after, message
+RESPONSE = struct.Struct("<Iidd64s")
+# partition, max_r
+TOKEN = struct.Struct("<Hq")
+
+REQ_CODES = {op: op.value for op in REQ}
+REQ_BY_CODE = {op.value: op for op in REQ}
+
+# How long an idle worker waits before it polls its response ring again.
+POLL_INTERVAL = 0.0005
+
+# The calls a worker decodes itself, all others go to the apply process.
+DECODED_CALLS = ("request", "add_shadow_op", "add_shadow_op_delta", "pass_token")
+
+
+def pack_request(req_id: int, req: Optional[Request], deadline: float) -> bytes:
+    """
+    Packs a client request into a record.
+    """
+    if req is None:
+        return REQUEST.pack(req_id, 0, 0, 0.0, deadline)
+    return REQUEST.pack(req_id, REQ_CODES[req.op], req.aid, req.amount, deadline)
+
+
+def unpack_request(record: bytes) -> Tuple[int, Optional[Request], float]:
+    """
+    Unpacks a record made by pack_request.
+
+    Returns:
+        Tuple[int, Optional[Request], float]: The request id, the request,
+            None if it was malformed, and its deadline.
+    """
+    req_id, code, aid, amount, deadline = REQUEST.unpack(record)
+    req = Request(aid, REQ_BY_CODE[code], amount) if code else None
+    return req_id, req, deadline
+
+
+def pack_shadow(op: ShadowOp) -> bytes:
+    """
+    Packs a shadow operation into a record.
+
+    Raises:
+        ValueError: If the clock has more than MAX_CLOCK entries.
+    """
+    b = op.depend.b
+    r = op.depend.r
+    clock = b + r
+    if len(clock) > MAX_CLOCK:
+        raise ValueError(f"clock of {len(clock)} entries does not fit a record")
+    clock += [0] * (MAX_CLOCK - len(clock))
+    return SHADOW.pack(
+        op.color, op.server_id, op.aid, op.amount, op.escrow, len(b), len(r), *clock
+    )
+
+
+def unpack_shadow(record: bytes) -> ShadowOp:
+    """
+    Unpacks a record made by pack_shadow.
+    """
+    color, server_id, aid, amount, escrow, nb, nr, *clock = SHADOW.unpack(record)
+    depend = VectorClock(nb, nr)
+    depend.b = clock[:nb]
+    depend.r = clock[nb : nb + nr]
+    return ShadowOp(
+        aid, server_id, depend, amount, COLOR.RED if color else COLOR.BLUE, escrow
+    )
+
+
+def pack_response(req_id: int, res: Response) -> bytes:
+    """
+    Packs a response into a record. Long messages are cut.
+    """
+    message = (res.message or "").encode()[:64]
+    return RESPONSE.pack(req_id, res.status, res.balance, res.retry_after, message)
+
+
+def unpack_token(record: bytes) -> Tuple[int, int]:
+    """
+    Unpacks a token record.
+
+    Returns:
+        Tuple[int, int]: The partition and max_r of the token.
+    """
+    return TOKEN.unpack(record)
+
+
+def unpack_response(record: bytes) -> Tuple[int, Response]:
+    """
+    Unpacks a record made by pack_response.
+    """
+    req_id, status, balance, retry_after, message = RESPONSE.unpack(record)
+    message = message.rstrip(b"\0").decode(errors="replace")
+    return req_id, Response(status, balance, message, retry_after)
+
+
+class WorkerRings:
+    """
+    The shared memory rings between the apply process and one worker.
+
+    Attributes:
+        requests (ShmRing): Client requests, from the worker.
+        shadows (ShmRing): Shadow operations, from the worker.
+        responses (ShmRing): Responses to client requests, to the worker.
+        tokens (ShmRing): Red tokens, from the worker.
+    """
+
+    def __init__(
+        self, max_requests: int, max_shadow: int, names: Optional[Tuple[str, ...]] = None
+    ) -> None:
+        """
+        Creates the rings, or attaches to the rings named `names`.
+
+        Args:
+            max_requests (int): The capacity of the request ring.
+            max_shadow (int): The capacity of the shadow operation ring.
+            names (Optional[Tuple[str, ...]]): The names of existing rings.
+        """
+        names = names or (None, None, None, None)
+        self.requests = ShmRing(REQUEST.size, max_requests, names[0])
+        self.shadows = ShmRing(SHADOW.size, max_shadow, names[1])
+        # requests wait for the red token after leaving the request ring
+        self.responses = ShmRing(RESPONSE.size, 2 * max_requests, names[2])
+        # there are fewer partitions than clock entries
+        self.tokens = ShmRing(TOKEN.size, MAX_CLOCK, names[3])
+
+    def names(self) -> Tuple[str, ...]:
+        """
+        Returns the names to attach to the rings with.
+        """
+        return (self.requests.name, self.shadows.name, self.responses.name, self.tokens.name)
+
+    def close(self) -> None:
+        """
+        Detaches from the rings.
+        """
+        self.requests.close()
+        self.shadows.close()
+        self.responses.close()
+        self.tokens.close()
+
+
+class RingResponder:
+    """
+    Takes the place of the response queue of a request that came through a
+    worker, and sends the response back through the worker's response ring.
+    """
+
+    def __init__(self, ring: ShmRing, req_id: int) -> None:
+        self.ring = ring
+        self.req_id = req_id
+
+    def put(self, res: Response) -> None:
+        """
+        Sends the response, waiting while the worker catches up.
+
+        Args:
+            res (Response): The response.
+        """
+        record = pack_response(self.req_id, res)
+        while not self.ring.push(record):
+            time.sleep(POLL_INTERVAL)
+
+
+class ReusePortXMLRPCServer(BoundedThreadingMixIn, SimpleXMLRPCServer):
+    """
+    A threaded xmlrpc server whose port other processes can listen on too.
+
+    The kernel hands every new connection to one of the workers, and the
+    connection stays with that worker while it is kept alive, so a delta
+    encoded stream keeps reaching the worker that knows it.
+    """
+
+    allow_reuse_port = True
+    request_queue_size = 128
+
+    def __init__(self, addr, requestHandler=KeepAliveRequestHandler, **kwargs):
+        super().__init__(addr, requestHandler, **kwargs)
+
+
+class DecodeWorker:
+    """
+    The rpc handler of a decode worker process.
+
+    Attributes:
+        control (str): The loopback address of the apply process.
+        rings (WorkerRings): The rings to the apply process.
+        waiters (dict): The response queue of every request in flight.
+        clock_decoder (ClockDecoder): The state of the delta encoded streams
+            that connected to this worker.
+    """
+
+    def __init__(self, control: str, rings: WorkerRings, config) -> None:
+        self.control = control
+        self.rings = rings
+        self.request_timeout = config.request_timeout
+        self.retry_after = config.retry_after
+        self.request_lock = threading.Lock()
+        self.shadow_lock = threading.Lock()
+        self.token_lock = threading.Lock()
+        self.req_ids = itertools.count(1)
+        self.waiters = {}
+        self.clock_decoder = ClockDecoder()
+        self.local = threading.local()
+        self.parent = os.getppid()
+        threading.Thread(target=self._read_responses, daemon=True).start()
+
+    def _dispatch(self, method: str, params: tuple):
+        if method in DECODED_CALLS:
+            return getattr(self, method)(*params)
+        # a ServerProxy must not be shared between threads
+        proxy = getattr(self.local, "proxy", None)
+        if proxy is None:
+            proxy = ServerProxy(self.control, allow_none=True)
+            self.local.proxy = proxy
+        return getattr(proxy, method)(*params)
+
+    def _read_responses(self) -> None:
+        checked = time.monotonic()
+        while True:
+            record = self.rings.responses.pop()
+            if record is None:
+                # do not outlive the apply process
+                if time.monotonic() - checked > 1.0:
+                    if os.getppid() != self.parent:
+                        os._exit(0)
+                    checked = time.monotonic()
+                time.sleep(POLL_INTERVAL)
+                continue
+            req_id, res = unpack_response(record)
+            waiter = self.waiters.get(req_id)
+            if waiter is not None:
+                waiter.put(res)
+
+    def request(self, req_dict: dict) -> dict:
+        """
+        Hands a client request to the apply process and returns the response.
+
+        Args:
+            req_dict (dict): The request.
+
+        Returns:
+            dict: The response.
+        """
+        req = Request.from_dict(req_dict)
+        req_id = next(self.req_ids) % 2**32
+        # CLOCK_MONOTONIC is shared by all processes of the machine
+        deadline = time.monotonic() + self.request_timeout
+        try:
+            record = pack_request(req_id, req, deadline)
+        except (struct.error, KeyError):
+            record = pack_request(req_id, None, deadline)
+        waiter = Queue()
+        self.waiters[req_id] = waiter
+        try:
+            with self.request_lock:
+                pushed = self.rings.requests.push(record)
+            if not pushed:
+                res = Response(STATUS_BUSY, message="Server busy", retry_after=self.retry_after)
+            else:
+                res = waiter.get(timeout=self.request_timeout + TOKEN_HOLD)
+        except Empty:
+            res = Response(status=STATUS_TIMEOUT, message="Request deadline exceeded")
+        finally:
+            del self.waiters[req_id]
+        return res.to_dict()
+
+    def _push_shadow(self, op: ShadowOp) -> None:
+        try:
+            record = pack_shadow(op)
+        except ValueError as e:
+            raise Fault(1, str(e)) from e
+        with self.shadow_lock:
+            if not self.rings.shadows.push(record):
+                raise Fault(FAULT_BUSY, "Server busy")
+
+    def add_shadow_op(self, shadow: dict) -> None:
+        """
+        Hands a shadow operation to the apply process.
+
+        Raises:
+            Fault: If the shadow operation ring is full.
+        """
+        self._push_shadow(ShadowOp.from_dict(shadow))
+
+    def add_shadow_op_delta(self, msg: list) -> bool:
+        """
+        Decodes a shadow operation sent on a delta encoded stream and hands
+        it to the apply process.
+
+        Returns:
+            bool: False if the sender has to start a new stream. Streams are
+                only known to the worker whose connection they came on, so
+                this happens once whenever a new connection of the sender
+                lands on another worker.
+
+        Raises:
+            Fault: If the shadow operation ring is full. The message is not
+                decoded then.
+        """
+        if self.rings.shadows.full():
+            raise Fault(FAULT_BUSY, "Server busy")
+        shadow = self.clock_decoder.decode(msg)
+        if shadow is None:
+            return False
+        self._push_shadow(shadow)
+        return True
+
+    def pass_token(
+        self,
+        max_r: int,
+        partition: int = 0,
+        ops: Optional[list] = None,
+        clock: Optional[dict] = None,
+    ) -> None:
+        """
+        Hands a red token, and the shadow operations riding along with it,
+        to the apply process. The operations go first, so the apply process
+        takes them in before the token.
+
+        Operations that do not fit the shadow operation ring are left out.
+        Their origins send them anyway, the token only brings them early.
+        The token itself waits for room, since it must not be lost.
+        """
+        if ops:
+            with self.shadow_lock:
+                for shadow in decode_ops(clock, ops):
+                    try:
+                        record = pack_shadow(shadow)
+                    except ValueError:
+                        continue
+                    if not self.rings.shadows.push(record):
+                        break
+        record = TOKEN.pack(partition, max_r)
+        with self.token_lock:
+            while not self.rings.tokens.push(record):
+                time.sleep(POLL_INTERVAL)
+
+
+def run_decode_worker(addr: Tuple[str, int], control: str, names: Tuple[str, ...], config) -> None:
+    """
+    Runs a decode worker process until the apply process exits.
+
+    Args:
+        addr (Tuple[str, int]): The public address of the server.
+        control (str): The loopback address of the apply process.
+        names (Tuple[str, ...]): The names of the worker's rings.
+        config (ServerConfig): The configuration of the server.
+    """
+    rings = WorkerRings(config.max_requests, config.max_shadow, names)
+    server = ReusePortXMLRPCServer(
+        addr, allow_none=True, max_connections=config.max_connections
+    )
+    server.register_instance(DecodeWorker(control, rings, config))
+    server.serve_forever()
+
+
+class DecodePool:
+    """
+    Starts the decode workers of a server and holds their rings.
+
+    Attributes:
+        rings (List[WorkerRings]): The rings of every worker.
+        processes (list): The worker processes.
+    """
+
+    rings: List[WorkerRings]
+
+    def __init__(self, addr: Tuple[str, int], control: str, config) -> None:
+        """
+        Starts `config.decode_workers` workers.
+
+        Args:
+            addr (Tuple[str, int]): The public address of the server.
+            control (str): The loopback address of the apply process.
+            config (ServerConfig): The configuration of the server.
+        """
+        # the apply process runs threads already, so do not fork it
+        ctx = multiprocessing.get_context("spawn")
+        self.rings = []
+        self.processes = []
+        for _ in range(config.decode_workers):
+            rings = WorkerRings(config.max_requests, config.max_shadow)
+            process = ctx.Process(
+                target=run_decode_worker,
+                args=(addr, control, rings.names(), config),
+                daemon=True,
+            )
+            process.start()
+            self.rings.append(rings)
+            self.processes.append(process)
+
+    def close(self) -> None:
+        """
+        Stops the workers and removes their rings.
+        """
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for rings in self.rings:
+            rings.close()
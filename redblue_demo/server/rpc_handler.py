@@ -0,0 +1,79 @@
+"""
+This module contains the KeepAliveRequestHandler class, which keeps the
+connection of a xmlrpc client open between calls, and the
+BoundedThreadingMixIn class, which bounds the number of handler threads.
+"""
+
+import socket
+import threading
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler
+from redblue_demo.common.common import HTTP_BUSY
+
+# How long an idle connection is kept open, in seconds.
+KEEP_ALIVE_TIMEOUT: float = 60.0
+# The default number of connections served at once.
+MAX_CONNECTIONS: int = 256
+# How long a connection over the limit may take to send its request, so that
+# closing it after the busy response does not reset it, in seconds.
+DRAIN_TIMEOUT: float = 0.05
+
+BUSY_RESPONSE = (
+    f"HTTP/1.1 {HTTP_BUSY} Service Unavailable\r\n"
+    "Content-Length: 0\r\n"
+    "Connection: close\r\n\r\n"
+).encode()
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    A xmlrpc request handler speaking HTTP/1.1, so that a client serves all
+    its calls over one connection instead of connecting for every call.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+
+
+class BoundedThreadingMixIn(ThreadingMixIn):
+    """
+    A ThreadingMixIn that serves at most `max_connections` connections at
+    once. A kept-alive connection holds its thread until it closes, so
+    connections over the limit get a busy response instead of a thread.
+    The caller never reached a handler, so it may retry anywhere.
+    """
+
+    # handler threads may idle on kept-alive connections, do not wait for them
+    daemon_threads = True
+
+    def __init__(self, *args, max_connections: int = MAX_CONNECTIONS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+    def _reject(self, request) -> None:
+        try:
+            request.settimeout(DRAIN_TIMEOUT)
+            try:
+                request.recv(65536)
+            except socket.timeout:
+                pass
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
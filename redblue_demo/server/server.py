@@ -2,39 +2,216 @@
 This module implements the server class for the RedBlue consistency protocol.
 """
 
-from socketserver import ThreadingMixIn
 import threading
 import copy
+import itertools
+import json
+import os
+import shutil
 import time
 from xmlrpc.server import SimpleXMLRPCServer
 
-from queue import Queue
+from queue import Empty, Full, Queue
 from collections import deque
 from typing import List, NamedTuple, Optional, Tuple
+from xmlrpc.client import Error, Fault, ServerProxy
 from redblue_demo.client.client import Client
 from redblue_demo.common.bank_storage import NUM_ACCOUNTS, BankStorage
+from redblue_demo.common.clock_delta import ClockDecoder, decode_ops, encode_ops
+from redblue_demo.common.escrow import EscrowTable
+from redblue_demo.common.mmap_bank_storage import MmapBankStorage
+from redblue_demo.common.op_log import OpLogWriter
+from redblue_demo.common.sparse_bank_storage import SparseBankStorage
 from redblue_demo.common.shadow_op import ShadowOp
 from redblue_demo.common.vector_clock import VectorClock
-from redblue_demo.common.common import COLOR, REQ, Request, Response
+from redblue_demo.server.rpc_handler import (
+    MAX_CONNECTIONS,
+    BoundedThreadingMixIn,
+    KeepAliveRequestHandler,
+)
+from redblue_demo.server.decode_worker import (
+    MAX_CLOCK,
+    DecodePool,
+    RingResponder,
+    unpack_request,
+    unpack_shadow,
+    unpack_token,
+)
+from redblue_demo.common.common import (
+    COLOR,
+    FAULT_BUSY,
+    REQ,
+    REQUEST_TIMEOUT,
+    STATUS_BUSY,
+    SERVER_DELAY,
+    STATUS_TIMEOUT,
+    TOKEN_HOLD,
+    Request,
+    Response,
+)
 
 
-class ThreadXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+class ThreadXMLRPCServer(BoundedThreadingMixIn, SimpleXMLRPCServer):
     """
     A subclass of SimpleXMLRPCServer that supports threading.
 
-    This class combines the functionality of the ThreadingMixIn class
+    This class combines the functionality of the BoundedThreadingMixIn class
     and the SimpleXMLRPCServer class to create a threaded XML-RPC server.
     """
 
+    # peers and clients open many connections at once, so the default
+    # backlog of 5 resets connections under load
+    request_queue_size = 128
+
+    def __init__(self, addr, requestHandler=KeepAliveRequestHandler, **kwargs):
+        super().__init__(addr, requestHandler, **kwargs)
+
+
+DISSEMINATION_DIRECT = "direct"
+DISSEMINATION_TREE = "tree"
+
+
+DEPENDENCY_FULL = "full"
+DEPENDENCY_ACCOUNT = "account"
+
+# How long a server that left keeps handing on the tokens still sent to it.
+LEAVE_GRACE: float = 5 * TOKEN_HOLD
+
+# The most accounts whose pool a token holder moves back into shares per round.
+REESCROW_BATCH: int = 64
+# The smallest amount worth moving from the pool back into a share.
+MIN_GRANT: float = 0.01
+
 
 class ServerConfig:
     """
     Represents the configuration for a server.
+
+    Attributes:
+        index (int): The index of the server.
+        addr (List[str]): The list of server addresses.
+        max_requests (int): The maximum number of queued client requests.
+        max_red (int): The maximum number of requests waiting for the red token.
+        max_shadow (int): The maximum number of remote shadow operations
+            received but not yet taken in by the main loop. Operations
+            waiting for their dependencies do not count, so the operation
+            they wait for is never turned away.
+        request_timeout (float): The deadline of a client request in seconds.
+        retry_after (float): The retry hint sent with a busy response.
+        dissemination (str): How shadow operations reach the peers, either
+            "direct" (the origin sends to every peer) or "tree" (the origin
+            sends to `fanout` peers, which relay along a tree rooted at it).
+        fanout (int): The number of children per node in "tree" mode.
+        join (Optional[str]): The address of a member to join through. The
+            server then starts with only its own address in `addr` and gets
+            its index and state from that member.
+        op_log_size (int): The number of own shadow operations kept for
+            servers that join later.
+        num_partitions (int): The number of red tokens. Account `aid` belongs
+            to partition `aid % num_partitions`, and red operations of
+            different partitions do not wait for each other.
+        escrow (bool): Whether every server holds an escrow share of every
+            balance. Withdrawals within the local share are then blue, and
+            only larger ones need the red token.
+        storage_path (Optional[str]): The balance file of a memory-mapped
+            storage. The balances are kept in memory if None.
+        sparse_storage (bool): Whether in-memory balances are only kept for
+            accounts whose balance differs from INIT_BALANCE.
+        num_accounts (int): The number of accounts; requests for other
+            account IDs are rejected.
+        record_path (Optional[str]): The operation log that receives every
+            shadow operation the server generates or receives.
+        dependency (str): What a shadow operation waits for, either "full"
+            (every operation its origin had applied) or "account" (only the
+            operations on the same account, and for red operations the
+            earlier red operations of their partition).
+        delta_clocks (bool): Whether shadow operations are sent to every peer
+            on an ordered stream whose messages only carry the clock entries
+            that changed since the previous message.
+        decode_workers (int): The number of worker processes that decode
+            requests and shadow operations and hand them to the server
+            through shared memory. If 0, the server decodes them itself.
+        token_ops (int): The number of recent red operations, and of own
+            operations since the token arrived, that ride along with a red
+            token, so the next holder can apply them before the token is
+            used. If 0, tokens only carry max_r.
+        max_connections (int): The maximum number of connections served at
+            once, by the server and by every decode worker. Further
+            connections get a busy HTTP response.
+        restore_path (Optional[str]): A checkpoint of this server to start
+            from. Its balance file is copied to `storage_path`, and every
+            member resends the shadow operations it does not cover.
     """
 
-    def __init__(self, index: int, addr: List[str]) -> None:
+    def __init__(
+        self,
+        index: int,
+        addr: List[str],
+        max_requests: int = 1024,
+        max_red: int = 256,
+        max_shadow: int = 4096,
+        request_timeout: float = REQUEST_TIMEOUT,
+        retry_after: float = 0.1,
+        dissemination: str = DISSEMINATION_DIRECT,
+        fanout: int = 2,
+        join: Optional[str] = None,
+        op_log_size: int = 10000,
+        num_partitions: int = 1,
+        escrow: bool = False,
+        storage_path: Optional[str] = None,
+        sparse_storage: bool = False,
+        num_accounts: int = NUM_ACCOUNTS,
+        record_path: Optional[str] = None,
+        dependency: str = DEPENDENCY_FULL,
+        delta_clocks: bool = False,
+        decode_workers: int = 0,
+        token_ops: int = 32,
+        max_connections: int = MAX_CONNECTIONS,
+        restore_path: Optional[str] = None,
+    ) -> None:
+        if dissemination not in (DISSEMINATION_DIRECT, DISSEMINATION_TREE):
+            raise ValueError(f"Unknown dissemination mode {dissemination}")
+        if fanout < 1:
+            raise ValueError("fanout must be positive")
+        if num_partitions < 1:
+            raise ValueError("num_partitions must be positive")
+        if dependency not in (DEPENDENCY_FULL, DEPENDENCY_ACCOUNT):
+            raise ValueError(f"Unknown dependency mode {dependency}")
+        if storage_path and sparse_storage:
+            raise ValueError("A memory-mapped storage cannot be sparse")
+        if decode_workers < 0:
+            raise ValueError("decode_workers must not be negative")
+        if max_connections < 1:
+            raise ValueError("max_connections must be positive")
+        if restore_path and not storage_path:
+            raise ValueError("A checkpoint is restored into a memory-mapped storage")
+        if restore_path and join:
+            raise ValueError("A restored server rejoins on its own, not through a member")
+        if decode_workers and len(addr) + num_partitions > MAX_CLOCK:
+            raise ValueError(f"Decode workers support clocks of up to {MAX_CLOCK} entries")
         self.index = index
         self.addr = addr
+        self.max_requests = max_requests
+        self.max_red = max_red
+        self.max_shadow = max_shadow
+        self.request_timeout = request_timeout
+        self.retry_after = retry_after
+        self.dissemination = dissemination
+        self.fanout = fanout
+        self.join = join
+        self.op_log_size = op_log_size
+        self.num_partitions = num_partitions
+        self.escrow = escrow
+        self.storage_path = storage_path
+        self.sparse_storage = sparse_storage
+        self.num_accounts = num_accounts
+        self.record_path = record_path
+        self.dependency = dependency
+        self.delta_clocks = delta_clocks
+        self.decode_workers = decode_workers
+        self.token_ops = token_ops
+        self.max_connections = max_connections
+        self.restore_path = restore_path
 
 
 # A NamedTuple to hold request and response queue
@@ -45,10 +222,12 @@ class RequestItem(NamedTuple):
     Attributes:
         req (Request): The request object.
         res_queue (Queue): The response queue.
+        deadline (float): The monotonic time after which the request is dropped.
     """
 
     req: Request
     res_queue: Queue
+    deadline: float
 
 
 class Server:
@@ -59,40 +238,119 @@ class Server:
         id (int): The index of the server.
         bank (BankStorage): The storage for the server's bank.
         now (VectorClock): The vector clock for the server.
-        max_r (int): The maximum red value seen by the server.
-        has_token (bool): Indicates whether the server has the token.
+        max_r (List[int]): The maximum red value seen by the server, per partition.
+        has_token (List[bool]): Indicates whether the server has the token of
+            each partition.
         peers (List[ServerProxy]): The list of server proxies representing the peers.
-        token_queue (Queue): The queue for token messages.
+        token_queue (Queue): The queue for (partition, max_r) token messages,
+            where a max_r of None marks the end of the hold time.
         req_queue (Queue): The queue for request messages.
         shadow_queue (Queue): The queue for shadow operation messages.
         op_list (deque): The list of shadow operations.
         red_list (deque): The list of red requests.
-        addrs (List[str]): The list of server addresses.
+        addrs (List[str]): The list of server addresses, None for servers
+            that left the cluster.
+        config (ServerConfig): The configuration of the server.
+        epoch (int): The number of membership changes seen by the server.
+        own_ops (deque): The latest shadow operations generated by the server.
+        member_queue (Queue): The queue for join and leave requests.
+        update_queue (Queue): The queue for membership updates from other
+            servers, each with the queue for its answer.
+        pending_members (deque): Join and leave requests waiting for the token.
+        escrow (Optional[EscrowTable]): The escrow shares in escrow mode.
+        release_queue (Queue): The queue for accounts whose share to release.
+        release_asked (dict): When the server last asked its peers to release
+            their shares of an account.
+        released (dict): When the server last released its share of an
+            account on request.
+        pool_accounts (List[set]): The accounts whose pool changed since the
+            server last tried to move it back into its share, per partition.
+        checkpoint_queue (Queue): The queue for checkpoint requests.
+        checkpoint_done (Queue): The checkpoints whose copy finished.
+        checkpointing (bool): Whether a checkpoint is being copied.
+        recorder (Optional[OpLogWriter]): The operation log being recorded.
+        account_clocks (dict): In "account" dependency mode, the number of
+            applied operations of every origin per account.
+        clock_decoder (ClockDecoder): The state of the delta encoded streams
+            from the peers.
+        decode_pool (Optional[DecodePool]): The decode workers, if any.
+        recent_red (List[deque]): The latest red operations applied, per
+            partition, to pass on with the token.
+        token_mark (List[int]): The number of own operations when the token
+            of each partition arrived.
+        backlogged (bool): Whether a peer is so far behind that new writes
+            are turned away, checked once per main loop round.
     """
 
-    def __init__(self, index: int, addrs: List[str]) -> None:
+    def __init__(
+        self, index: int, addrs: List[str], config: Optional[ServerConfig] = None
+    ) -> None:
         """
         Initializes a new instance of the Server class.
 
         Args:
             index (int): The index of the server.
             addrs (List[str]): The list of server addresses.
+            config (Optional[ServerConfig]): The configuration of the server.
         """
         num_server = len(addrs)
+        self.config = config if config is not None else ServerConfig(index, addrs)
 
         self.id = index
-        self.bank = BankStorage()
-        self.now = VectorClock(num_server)
-        self.max_r = 0
-        self.has_token = False
+        num_accounts = self.config.num_accounts
+        restore_path = self.config.restore_path
+        if restore_path:
+            if os.path.abspath(restore_path) != os.path.abspath(self.config.storage_path):
+                shutil.copyfile(restore_path, self.config.storage_path)
+            self.bank = MmapBankStorage(self.config.storage_path, num_accounts)
+        elif self.config.storage_path:
+            # the clock starts at zero, so must the balances
+            self.bank = MmapBankStorage(
+                self.config.storage_path, num_accounts, reset=True
+            )
+        elif self.config.sparse_storage:
+            self.bank = SparseBankStorage(num_accounts)
+        else:
+            self.bank = BankStorage(num_accounts)
+        num_partitions = self.config.num_partitions
+        self.now = VectorClock(num_server, num_partitions)
+        self.max_r = [0] * num_partitions
+        self.has_token = [False] * num_partitions
         self.peers = [None] * num_server
         self.token_queue = Queue()
-        self.req_queue = Queue()
+        self.req_queue = Queue(maxsize=self.config.max_requests)
         self.shadow_queue = Queue()
         self.op_list = deque()
         self.red_list = deque()
+        self.epoch = 0
+        self.own_ops = deque(maxlen=self.config.op_log_size)
+        self.member_queue = Queue()
+        self.update_queue = Queue()
+        self.pending_members = deque()
+        self.running = True
+        self.escrow = EscrowTable(num_server) if self.config.escrow else None
+        self.release_queue = Queue()
+        self.release_asked = {}
+        self.released = {}
+        self.pool_accounts = [set() for _ in range(num_partitions)]
+        self.checkpoint_queue = Queue()
+        self.checkpoint_done = Queue()
+        self.checkpointing = False
+        self.account_clocks = {}
+        self.clock_decoder = ClockDecoder()
+        self.decode_pool = None
+        self.recent_red = [
+            deque(maxlen=self.config.token_ops) for _ in range(num_partitions)
+        ]
+        self.token_mark = [0] * num_partitions
+        self.backlogged = False
+        self.recorder = None
+        if self.config.record_path:
+            self.recorder = OpLogWriter(self.config.record_path, self.config.dependency)
 
         self.addrs = addrs
+        if restore_path:
+            self._restore(restore_path)
 
     @classmethod
     def from_config(cls, config: ServerConfig) -> "Server":
@@ -105,7 +363,7 @@ class Server:
         Returns:
             Server: The new Server instance.
         """
-        return cls(config.index, config.addr)
+        return cls(config.index, config.addr, config)
 
     def run(self):
         """
@@ -115,40 +373,90 @@ class Server:
         and starts the main loop.
         """
         # Setup RPC server
-        ip, port = self.addrs[self.id].split(":")
+        own_addr = self.addrs[0] if self.config.join else self.addrs[self.id]
+        ip, port = own_addr.split(":")
         port = int(port)
         # server = SimpleXMLRPCServer((ip, port), allow_none=True)
-        server = ThreadXMLRPCServer((ip, port), allow_none=True)
+        if self.config.decode_workers:
+            # the workers serve the public address and forward what they do
+            # not decode themselves to a loopback port
+            server = ThreadXMLRPCServer(
+                ("127.0.0.1", 0),
+                allow_none=True,
+                max_connections=self.config.max_connections,
+            )
+            control = f"http://127.0.0.1:{server.server_address[1]}"
+            self.decode_pool = DecodePool((ip, port), control, self.config)
+        else:
+            server = ThreadXMLRPCServer(
+                (ip, port), allow_none=True, max_connections=self.config.max_connections
+            )
         server.register_instance(self)
 
         # Setup peer connection
         def setup_peers():
+            if self.config.join:
+                self._bootstrap(self.config.join, own_addr)
             for i, addr in enumerate(self.addrs):
-                if i == self.id:
+                if i == self.id or addr is None:
                     continue
-                self.peers[i] = Client(f"http://{addr}")
+                self.peers[i] = self._connect(addr)
+            if self.config.restore_path:
+                self._rejoin()
             print(f"server {self.id}: peer connection established")
             self._main_loop()
+            # the server left the cluster
+            for peer in self.peers:
+                if peer is not None:
+                    peer.flush()
+            grace_end = time.monotonic() + LEAVE_GRACE
+            while time.monotonic() < grace_end:
+                self._forward_tokens()
+                time.sleep(SERVER_DELAY)
+            for peer in self.peers:
+                if peer is not None:
+                    peer.close()
+            if self.decode_pool:
+                self.decode_pool.close()
+            server.shutdown()
 
         peer_thread = threading.Thread(target=setup_peers)
         peer_thread.start()
         server.serve_forever()
 
-    def _set_token_timeout(self) -> None:
+    def _connect(self, addr: str) -> Client:
+        delta_sender = self.id if self.config.delta_clocks else None
+        return Client(f"http://{addr}", delta_sender)
+
+    def _set_token_timeout(self, partition: int) -> None:
         def timeout():
-            time.sleep(1)
-            self.token_queue.put(0)
+            time.sleep(TOKEN_HOLD)
+            # None marks the end of the hold time, not a token
+            self.token_queue.put((partition, None))
 
         threading.Thread(target=timeout).start()
 
-    def _primary(self) -> bool:
-        return self.has_token and self.max_r == self.now.red()
+    def _partition(self, aid: int) -> int:
+        return aid % self.config.num_partitions
+
+    def _primary(self, partition: int) -> bool:
+        return (
+            self.has_token[partition]
+            and self.max_r[partition] == self.now.red(partition)
+        )
+
+    def _tick(self, shadow: ShadowOp) -> None:
+        partition = self._partition(shadow.aid)
+        self.now.tick(shadow.server_id, shadow.color, partition)
+        self.now.print(self.id)
+        if self.now.red(partition) > self.max_r[partition]:
+            self.max_r[partition] = self.now.red(partition)
 
     def _generate_shadow(
         self, req: Request, primary: bool
     ) -> Tuple[ShadowOp, Optional[Response], bool]:
         shadow = ShadowOp(
-            aid=req.aid, depend=copy.deepcopy(self.now), server_id=self.id
+            aid=req.aid, depend=self._dependency(req.aid), server_id=self.id
         )
         balance = self.bank.get_account(req.aid).get_balance()
         res = None
@@ -156,8 +464,11 @@ class Server:
         if req.op == REQ.DEPOSIT:
             shadow.amount = req.amount
             shadow.color = COLOR.BLUE
+            shadow.escrow = req.amount if self.escrow else 0
             res = Response(status=0, balance=balance + req.amount)
             ok = True
+        elif req.op == REQ.WITHDRAW and self.escrow:
+            res, ok = self._generate_escrow_withdraw(req, shadow, balance, primary)
         elif req.op == REQ.WITHDRAW:
             if primary:
                 if balance >= req.amount:
@@ -177,6 +488,7 @@ class Server:
             delta = self.bank.get_account(req.aid).compute_interest()
             shadow.amount = delta
             shadow.color = COLOR.BLUE
+            shadow.escrow = delta if self.escrow else 0
             res = Response(status=0, balance=balance + delta)
             ok = True
         elif req.op == REQ.CHECK:
@@ -188,112 +500,818 @@ class Server:
             raise ValueError("Unknown operation")
         return shadow, res, ok
 
+    def _generate_escrow_withdraw(
+        self, req: Request, shadow: ShadowOp, balance: float, primary: bool
+    ) -> Tuple[Optional[Response], bool]:
+        share = self.escrow.share(req.aid, self.id)
+        if req.amount <= share:
+            # only this server spends its own share, so no coordination is needed
+            shadow.amount = -req.amount
+            shadow.escrow = -req.amount
+            shadow.color = COLOR.BLUE
+            return Response(status=0, balance=balance - req.amount), True
+        if not primary:
+            return None, False
+
+        pool = balance - self.escrow.total(req.aid)
+        if req.amount <= share + pool:
+            shadow.amount = -req.amount
+            shadow.escrow = -share
+            shadow.color = COLOR.RED
+            return Response(status=0, balance=balance - req.amount), True
+        if req.amount > balance:
+            shadow.amount = 0
+            shadow.color = COLOR.BLUE
+            return (
+                Response(status=-1, balance=balance, message="Insufficient balance"),
+                True,
+            )
+
+        # the money is there but escrowed by other servers, ask them for it
+        now = time.monotonic()
+        if now - self.release_asked.get(req.aid, -TOKEN_HOLD) >= TOKEN_HOLD:
+            self.release_asked[req.aid] = now
+            for i in self._members():
+                if i != self.id:
+                    self.peers[i].release_escrow_async(req.aid)
+        return None, False
+
+    def _release_escrow(self, aid: int) -> None:
+        share = self.escrow.share(aid, self.id)
+        if share <= 0:
+            return
+        shadow = ShadowOp(
+            aid=aid, depend=self._dependency(aid), server_id=self.id, escrow=-share
+        )
+        self._dispatch_shadow_op(shadow)
+        self.released[aid] = time.monotonic()
+
+    def _reescrow(self, partition: int) -> None:
+        """
+        Moves the pools of the partition's accounts back into the own share,
+        up to an even split of the balance between the members, so that the
+        following withdrawals are blue again. Granting a share spends the
+        pool, so it is a red operation and needs the token.
+        """
+        accounts = self.pool_accounts[partition]
+        now = time.monotonic()
+        # a peer that asked for the share needs a token round to spend it
+        hold = len(self._members()) * TOKEN_HOLD
+        held = []
+        batch = 0
+        while accounts and batch < REESCROW_BATCH:
+            aid = accounts.pop()
+            if now - self.released.get(aid, -hold) < hold:
+                # set aside, so that held accounts do not fill the batch
+                held.append(aid)
+                continue
+            batch += 1
+            self.released.pop(aid, None)
+            balance = self.bank.get_account(aid).get_balance()
+            pool = balance - self.escrow.total(aid)
+            share = self.escrow.share(aid, self.id)
+            grant = min(pool, balance / len(self._members()) - share)
+            if grant < MIN_GRANT:
+                continue
+            shadow = ShadowOp(
+                aid=aid,
+                depend=self._dependency(aid),
+                server_id=self.id,
+                amount=0,
+                color=COLOR.RED,
+                escrow=grant,
+            )
+            self._dispatch_shadow_op(shadow)
+        accounts.update(held)
+
+    def _busy(self, message: str, retry_after: float) -> Response:
+        return Response(status=STATUS_BUSY, message=message, retry_after=retry_after)
+
     def _do_request(self, req_item: RequestItem) -> bool:
-        primary = self._primary()
         req = req_item.req
+        # drop requests whose caller already gave up
+        if time.monotonic() > req_item.deadline:
+            req_item.res_queue.put(
+                Response(status=STATUS_TIMEOUT, message="Request deadline exceeded")
+            )
+            return True
         # verify request
-        if req.aid < 0 or req.aid >= NUM_ACCOUNTS:
+        if req is None:
+            req_item.res_queue.put(Response(status=-1, message="Invalid request"))
+            return True
+        if req.aid < 0 or req.aid >= self.config.num_accounts:
             req_item.res_queue.put(Response(status=-1, message="Invalid Account Id"))
             return True
+        if self.backlogged and req.op != REQ.CHECK:
+            # a peer cannot keep up, let it catch up before adding to its backlog
+            req_item.res_queue.put(
+                self._busy("A peer is too far behind", self.config.retry_after)
+            )
+            return True
 
         # try generate shadow op
+        primary = self._primary(self._partition(req.aid))
         shadow, res, ok = self._generate_shadow(req, primary)
         if ok:
             assert isinstance(res, Response)
             req_item.res_queue.put(res)
             self._dispatch_shadow_op(shadow)
             return True
-        if not ok and primary:
+        if not ok and primary and not self.escrow:
             print(f"failed {req.op}: ")
         return False
 
+    def _account_clock(self, aid: int) -> list:
+        clock = self.account_clocks.get(aid)
+        if clock is None:
+            clock = [0] * len(self.now.b)
+            self.account_clocks[aid] = clock
+        elif len(clock) < len(self.now.b):
+            clock.extend([0] * (len(self.now.b) - len(clock)))
+        return clock
+
+    def _dependency(self, aid: int) -> VectorClock:
+        """
+        Returns what a new shadow operation on account `aid` depends on.
+        """
+        if self.config.dependency == DEPENDENCY_FULL:
+            return copy.deepcopy(self.now)
+        # red operations add the red entry of their partition on dispatch
+        depend = VectorClock(len(self.now.b), len(self.now.r))
+        depend.b = list(self._account_clock(aid))
+        return depend
+
+    def _ready(self, shadow: ShadowOp) -> bool:
+        if self.config.dependency == DEPENDENCY_FULL:
+            return shadow.depend.ready(self.now)
+        clock = self._account_clock(shadow.aid)
+        for i, bi in enumerate(shadow.depend.b):
+            if bi > clock[i]:
+                return False
+        for p, rp in enumerate(shadow.depend.r):
+            if rp > self.now.r[p]:
+                return False
+        return True
+
+    def _apply_shadow(self, shadow: ShadowOp) -> None:
+        shadow.apply(self.bank)
+        if shadow.color == COLOR.RED:
+            self.recent_red[self._partition(shadow.aid)].append(shadow)
+        if self.escrow:
+            self.escrow.add(shadow.aid, shadow.server_id, shadow.escrow)
+            if shadow.escrow != shadow.amount:
+                # the pool changed
+                self.pool_accounts[self._partition(shadow.aid)].add(shadow.aid)
+        if self.config.dependency == DEPENDENCY_ACCOUNT:
+            self._account_clock(shadow.aid)[shadow.server_id] += 1
+        self._tick(shadow)
+
     def _dispatch_shadow_op(self, shadow: ShadowOp):
-        if shadow.amount == 0:
+        if shadow.amount == 0 and shadow.escrow == 0:
             return  # read only, no need to dispatch shadow op
-        shadow.apply(self.bank)
-        self.now.tick(shadow.server_id, shadow.color)
-        self.now.print(self.id)
-        if self.now.red() > self.max_r:
-            self.max_r = self.now.red()
+        if shadow.color == COLOR.RED and self.config.dependency == DEPENDENCY_ACCOUNT:
+            # the account clock covers the account's operations, red or not,
+            # so only the order of the partition's red operations is missing
+            partition = self._partition(shadow.aid)
+            shadow.depend.r[partition] = self.now.red(partition)
+        self._apply_shadow(shadow)
+        if self.recorder:
+            self.recorder.write(shadow, local=True)
+
+        self.own_ops.append(shadow)
+        self._send_shadow_op(shadow)
+
+    def _members(self) -> List[int]:
+        return [i for i, addr in enumerate(self.addrs) if addr is not None]
 
-        for peer in self.peers:
+    def _next_member(self) -> int:
+        members = self._members()
+        # a server that left is no member, but still hands tokens on
+        return next((i for i in members if i > self.id), members[0])
+
+    def _relay_targets(self, origin: int) -> List[int]:
+        """
+        Returns the peers this server sends a shadow operation of `origin` to.
+
+        In "tree" mode the members are numbered by their distance from the
+        origin, and the node with rank k relays to the ranks
+        k * fanout + 1 ... k * fanout + fanout, so every member is reached
+        exactly once and the origin only sends `fanout` messages.
+        """
+        members = self._members()
+        if self.config.dissemination == DISSEMINATION_DIRECT:
+            return [i for i in members if i != self.id] if origin == self.id else []
+
+        size = len(members)
+        start = members.index(origin)
+        rank = (members.index(self.id) - start) % size
+        fanout = self.config.fanout
+        first = rank * fanout + 1
+        return [
+            members[(start + child) % size]
+            for child in range(first, min(first + fanout, size))
+        ]
+
+    def _send_shadow_op(self, shadow: ShadowOp) -> None:
+        for i in self._relay_targets(shadow.server_id):
+            peer = self.peers[i]
             if peer is not None:
                 assert isinstance(peer, Client)
                 peer.add_shadow_op_async(shadow)
 
-    def _main_loop(self) -> None:
-        if self.id == 0:
-            self._set_token_timeout()
-            self.has_token = True
+    def _applied(self, shadow: ShadowOp) -> bool:
+        # Operations of one origin are applied in the order they were
+        # generated, so anything at or below our entry for it is a duplicate.
+        # With account dependencies that order only holds per account.
+        origin = shadow.server_id
+        if self.config.dependency == DEPENDENCY_ACCOUNT:
+            return self._account_clock(shadow.aid)[origin] > shadow.depend.b[origin]
+        return self.now.b[origin] > shadow.depend.b[origin]
+
+    def _token_ops(self, partition: int) -> List[ShadowOp]:
+        """
+        Returns the operations the next holder needs to use the token of
+        `partition` at once: the latest red operations of the partition,
+        and the own operations since the token arrived, which the own red
+        operations depend on.
+        """
+        limit = self.config.token_ops
+        fresh = min(self.now.b[self.id] - self.token_mark[partition], limit, len(self.own_ops))
+        ops = list(itertools.islice(self.own_ops, len(self.own_ops) - fresh, None))
+        sent = {id(op) for op in ops}
+        ops.extend(op for op in self.recent_red[partition] if id(op) not in sent)
+        return ops
+
+    def _pass_token(self, next_id: int, partition: int) -> None:
+        max_r = self.max_r[partition]
+
+        def hand_back():
+            # the peer never got the token, so take it back and pass it on
+            # once the membership tells where to
+            self.token_queue.put((partition, max_r))
+
+        peer = self.peers[next_id]
+        # a server that left no longer applies operations to pass along
+        if self.config.token_ops and self.running:
+            clock = self.now.copy()
+            ops = encode_ops(clock, self._token_ops(partition))
+            peer.pass_token(max_r, partition, ops, clock, on_error=hand_back)
+        else:
+            peer.pass_token(max_r, partition, on_error=hand_back)
 
+    def _process_token_queue(self) -> None:
+        while not self.token_queue.empty():
+            partition, max_r = self.token_queue.get()
+            if max_r is None:
+                # the hold time is over, unless the token left with a leave
+                if not self.has_token[partition]:
+                    continue
+                next_id = self._next_member()
+                if self.peers[next_id] is not None:
+                    self.has_token[partition] = False
+                    self._pass_token(next_id, partition)
+                    # print(f"server {self.id}: pass token to {next_id}")
+                else:
+                    # the peer is still connecting, try again later
+                    self._set_token_timeout(partition)
+            else:
+                self.max_r[partition] = max_r
+                self.has_token[partition] = True
+                self.token_mark[partition] = self.now.b[self.id]
+                self._set_token_timeout(partition)
+                # print(f"server {self.id}: received token")
+
+    def _process_shadow_queue(self) -> None:
+        while not self.shadow_queue.empty():
+            shadow: ShadowOp = self.shadow_queue.get()
+            if self.recorder:
+                self.recorder.write(shadow, local=False)
+            # the origin may know of servers that joined after our last update
+            self.now.resize(len(shadow.depend.b))
+            if self._applied(shadow):
+                continue
+            self._send_shadow_op(shadow)
+            self.op_list.append(shadow)
+
+    def _process_req_queue(self) -> None:
+        while not self.req_queue.empty():
+            req_item = self.req_queue.get()
+            if self._do_request(req_item):
+                continue
+            if len(self.red_list) >= self.config.max_red:
+                # the token is a whole tour away, ask the client to come back then
+                req_item.res_queue.put(
+                    self._busy(
+                        "Too many requests waiting for the red token",
+                        TOKEN_HOLD * len(self._members()),
+                    )
+                )
+                continue
+            self.red_list.append(req_item)
+            # print(f"server {self.id}: add to redList")
+
+    def _process_op_list(self) -> None:
+        while True:
+            todo = False
+            for shadow in list(self.op_list):
+                if self._applied(shadow):
+                    self.op_list.remove(shadow)
+                    continue
+                if self._ready(shadow):
+                    self._apply_shadow(shadow)
+
+                    todo = True
+                    self.op_list.remove(shadow)
+
+            if not todo:
+                break
+            # print(f"server {self.id}: process shadowOp")
+
+    def _process_red_list(self) -> None:
+        if not self.red_list:
+            return
+        primary = [self._primary(p) for p in range(self.config.num_partitions)]
+        now = time.monotonic()
+        for req_item in list(self.red_list):
+            if primary[self._partition(req_item.req.aid)]:
+                self.red_list.remove(req_item)
+                ok = self._do_request(req_item)
+                if not ok and self.escrow:
+                    # waiting for other servers to release their shares
+                    self.red_list.append(req_item)
+                elif not ok:
+                    raise ValueError(f"server {self.id}: process redList fail")
+            elif req_item.deadline < now:
+                # the deadline passed while waiting for the token
+                self.red_list.remove(req_item)
+                req_item.res_queue.put(
+                    Response(status=STATUS_TIMEOUT, message="Request deadline exceeded")
+                )
+
+    def _bootstrap(self, seed: str, own_addr: str) -> None:
+        """
+        Joins the cluster through the member at `seed` and loads its state.
+        """
+        snapshot = ServerProxy(f"http://{seed}", allow_none=True).join(own_addr)
+        self._load_snapshot(snapshot)
+        print(f"server {self.id}: joined through {seed}")
+
+    def _load_snapshot(self, snapshot: dict) -> None:
+        """
+        Takes the id, membership, clock and balances from a join snapshot,
+        or all but the balances from the state written with a checkpoint.
+        """
+        self.id = snapshot["id"]
+        self.epoch = snapshot["epoch"]
+        self.addrs = snapshot["addrs"]
+        self.peers = [None] * len(self.addrs)
+        self.now = VectorClock(len(self.addrs), self.config.num_partitions)
+        self.now.b = snapshot["clock"]["b"]
+        self.now.r = snapshot["clock"]["r"]
+        self.max_r = snapshot["max_r"]
+        if "balances" in snapshot:
+            self.bank.import_balances(snapshot["balances"])
+        if self.escrow:
+            self.escrow.import_shares(snapshot["escrow"])
+
+    def _restore(self, path: str) -> None:
+        """
+        Takes the state written with the checkpoint at `path`, whose balances
+        the storage was opened on.
+        """
+        with open(f"{path}.json", encoding="utf-8") as f:
+            state = json.load(f)
+        if state["id"] != self.id:
+            raise ValueError(f"{path} is a checkpoint of server {state['id']}")
+        self._load_snapshot(state)
+        print(f"server {self.id}: restored {path} at {self.now.b}")
+
+    def _rejoin(self) -> None:
+        """
+        Asks every member to resend its own shadow operations the restored
+        checkpoint does not cover, and takes the membership from the newest
+        answer. Members that joined meanwhile are asked as well.
+
+        Raises:
+            ValueError: If a member does not answer or cannot catch this
+                server up. It then has to join afresh.
+        """
+        asked = {self.id}
         while True:
+            todo = [i for i in self._members() if i not in asked]
+            if not todo:
+                break
+            for i in todo:
+                asked.add(i)
+                try:
+                    state = self.peers[i].rejoin(self.id, self.now.b)
+                except (OSError, Error) as e:
+                    raise ValueError(f"server {i} cannot catch up server {self.id}: {e}") from e
+                update = {
+                    "epoch": state["epoch"],
+                    "addrs": state["addrs"],
+                    "joined": -1,
+                    "clock": [],
+                }
+                self._apply_membership(update)
+        print(f"server {self.id}: rejoined the cluster")
+
+    def _catch_up(self, rejoined: int, clock: List[int]) -> dict:
+        """
+        Resends the own shadow operations a restored server missed, on a new
+        stream, as for a server that joins.
+
+        Returns:
+            dict: The epoch and addresses for the restored server.
+
+        Raises:
+            ValueError: If the server is no member, or it cannot be caught up
+                because this server applied operations it generated after
+                its checkpoint, or its op log no longer reaches back to it.
+        """
+        if not self.running:
+            raise ValueError("Server left the cluster")
+        if rejoined == self.id or rejoined >= len(self.addrs) or self.addrs[rejoined] is None:
+            raise ValueError(f"Server {rejoined} is no member")
+        restored = clock[rejoined]
+        lost = self.now.b[rejoined] > restored or any(
+            shadow.server_id == rejoined and shadow.depend.b[rejoined] >= restored
+            for shadow in self.op_list
+        )
+        if lost:
+            raise ValueError(f"Server {rejoined} lost operations since its checkpoint")
+        covered = clock[self.id] if self.id < len(clock) else 0
+        if self.own_ops and self.own_ops[0].depend.b[self.id] > covered:
+            raise ValueError(f"Op log too short to catch up server {rejoined}")
+        # drop what was still queued for the stopped server
+        self.peers[rejoined].close()
+        self.peers[rejoined] = self._connect(self.addrs[rejoined])
+        for shadow in self.own_ops:
+            if shadow.depend.b[self.id] >= covered:
+                self.peers[rejoined].add_shadow_op_async(shadow)
+        print(f"server {self.id}: catching up server {rejoined} from {covered}")
+        return {"epoch": self.epoch, "addrs": self.addrs}
+
+    def _apply_membership(self, update: dict) -> bool:
+        """
+        Applies a membership update made by the token holder.
+
+        The update carries the clock of the new server's snapshot, so every
+        member resends its own shadow operations the snapshot does not cover.
+
+        Returns:
+            bool: False if the update joins a server that this server cannot
+                catch up, because its op log no longer reaches back to the
+                snapshot. The update is not applied then.
+        """
+        if update["epoch"] <= self.epoch:
+            return True
+        joined = update["joined"]
+        clock = update["clock"]
+        covered = clock[self.id] if 0 <= self.id < len(clock) else 0
+        if joined >= 0 and joined != self.id:
+            if self.own_ops and self.own_ops[0].depend.b[self.id] > covered:
+                print(f"server {self.id}: op log too short to catch up server {joined}")
+                return False
+        self.epoch = update["epoch"]
+        addrs = update["addrs"]
+        self.now.resize(len(addrs))
+        self.peers.extend([None] * (len(addrs) - len(self.peers)))
+        for i, addr in enumerate(addrs):
+            if i == self.id:
+                continue
+            if addr is None:
+                if self.peers[i] is not None:
+                    # stop resending to a peer that is gone for good
+                    self.peers[i].close()
+                self.peers[i] = None
+            elif i >= len(self.addrs) or self.addrs[i] is None:
+                self.peers[i] = self._connect(addr)
+        self.addrs = list(addrs)
+
+        if joined < 0 or joined == self.id:
+            return True
+        for shadow in self.own_ops:
+            if shadow.depend.b[self.id] >= covered:
+                self.peers[joined].add_shadow_op_async(shadow)
+        return True
+
+    def _broadcast_membership(self, update: dict, skip: int) -> bool:
+        """
+        Sends a membership update to every other member.
+
+        Returns:
+            bool: False if a member refused the update. Members that did not
+                answer are left to learn of it later.
+        """
+        accepted = True
+        for i in self._members():
+            if i in (self.id, skip):
+                continue
             try:
-                # Process token_queue
-                while not self.token_queue.empty():
-                    max_r = self.token_queue.get()
-                    if self.has_token:
-                        next_id = (self.id + 1) % len(self.peers)
-                        if self.peers[next_id] is not None:
-                            self.has_token = False
-                            self.peers[next_id].pass_token(self.max_r)
-                            # print(f"server {self.id}: pass token to {next_id}")
-                    else:
-                        self.max_r = max_r
-                        self.has_token = True
-                        self._set_token_timeout()
-                        # print(f"server {self.id}: received token")
-
-                # Process shadow_queue
-                while not self.shadow_queue.empty():
-                    shadow: ShadowOp = self.shadow_queue.get()
-                    self.op_list.append(shadow)
-
-                # Process req_queue
-                while not self.req_queue.empty():
-                    req_item = self.req_queue.get()
-                    if not self._do_request(req_item):
-                        self.red_list.append(req_item)
-                        # print(f"server {self.id}: add to redList")
-
-                # Process op_list
-                while True:
-                    todo = False
-                    for shadow in list(self.op_list):
-                        if shadow.depend.ready(self.now):
-                            shadow.apply(self.bank)
-                            self.now.tick(shadow.server_id, shadow.color)
-                            self.now.print(self.id)
-                            if self.now.red() > self.max_r:
-                                self.max_r = self.now.red()
-
-                            todo = True
-                            self.op_list.remove(shadow)
-
-                    if not todo:
-                        break
-                    # print(f"server {self.id}: process shadowOp")
-
-                # Process red_list if primary
-                if self._primary():
-                    for req_item in list(self.red_list):
-                        ok = self._do_request(req_item)
-                        if not ok:
-                            raise ValueError(f"server {self.id}: process redList fail")
-                    # Clear red_list after processing all items
-                    self.red_list.clear()
+                accepted = self.peers[i].update_members(update) and accepted
+            except (OSError, Error) as e:
+                print(f"server {self.id}: membership update to {i} failed: {e}")
+        return accepted
+
+    def _admit(self, addr: str) -> dict:
+        """
+        Adds a server to the cluster and returns the snapshot it starts from.
+
+        Raises:
+            ValueError: If a member cannot catch the server up. The server is
+                then removed again and may retry the join.
+        """
+        new_id = len(self.addrs)
+        if self.decode_pool and new_id + 1 + self.config.num_partitions > MAX_CLOCK:
+            raise ValueError("The clock would not fit the decode worker records")
+        clock = self.now.copy()
+        clock.resize(new_id + 1)
+        update = {
+            "epoch": self.epoch + 1,
+            "addrs": self.addrs + [addr],
+            "joined": new_id,
+            "clock": clock.b,
+        }
+        self._apply_membership(update)
+        if not self._broadcast_membership(update, new_id):
+            # the slot stays empty, as if the server joined and left again
+            addrs = list(self.addrs)
+            addrs[new_id] = None
+            revert = {"epoch": self.epoch + 1, "addrs": addrs, "joined": -1, "clock": []}
+            self._apply_membership(revert)
+            self._broadcast_membership(revert, new_id)
+            raise ValueError(f"A member cannot catch up {addr}, retry the join")
+        print(f"server {self.id}: server {new_id} at {addr} joined")
+        return {
+            "id": new_id,
+            "epoch": self.epoch,
+            "addrs": self.addrs,
+            "clock": {"b": clock.b, "r": clock.r},
+            "max_r": self.max_r,
+            "balances": self.bank.export_balances(),
+            "escrow": self.escrow.export_shares() if self.escrow else None,
+        }
+
+    def _leave(self) -> None:
+        """
+        Removes this server from the cluster and hands the token on.
+        """
+        if len(self._members()) == 1:
+            raise ValueError(f"server {self.id}: the last member cannot leave")
+        if self.escrow:
+            raise ValueError(f"server {self.id}: escrow shares would be stranded")
+        next_id = self._next_member()
+        addrs = list(self.addrs)
+        addrs[self.id] = None
+        update = {"epoch": self.epoch + 1, "addrs": addrs, "joined": -1, "clock": []}
+        self._broadcast_membership(update, -1)
+        self.epoch += 1
+        self.addrs = addrs
+        for partition, has_token in enumerate(self.has_token):
+            if has_token:
+                self.has_token[partition] = False
+                self._pass_token(next_id, partition)
+        self.running = False
 
+        # clients can retry on the remaining members
+        busy = self._busy("Server left the cluster", self.config.retry_after)
+        for req_item in self.red_list:
+            req_item.res_queue.put(busy)
+        self.red_list.clear()
+        while not self.req_queue.empty():
+            self.req_queue.get().res_queue.put(busy)
+        # the main loop stops, so answer what it would have handled later
+        left = Fault(FAULT_BUSY, "Server left the cluster")
+        while not self.member_queue.empty():
+            self.pending_members.append(self.member_queue.get())
+        while self.pending_members:
+            self.pending_members.popleft()[2].put(left)
+        while not self.checkpoint_queue.empty():
+            self.checkpoint_queue.get()[1].put(left)
+        print(f"server {self.id}: left the cluster")
+
+    def _forward_tokens(self) -> None:
+        """
+        Hands the tokens that reach a server after it left the cluster on to
+        the next member, so that none is lost while the others learn of the
+        leave.
+        """
+        self._process_update_queue()
+        while not self.token_queue.empty():
+            partition, max_r = self.token_queue.get()
+            if max_r is None:
+                continue
+            self.max_r[partition] = max_r
+            self._pass_token(self._next_member(), partition)
+
+    def _process_pool_accounts(self) -> None:
+        for partition, accounts in enumerate(self.pool_accounts):
+            if accounts and self._primary(partition):
+                self._reescrow(partition)
+
+    def _process_release_queue(self) -> None:
+        while not self.release_queue.empty():
+            self._release_escrow(self.release_queue.get())
+
+    def _begin_checkpoint(self, dest: str, res_queue: Queue) -> None:
+        """
+        Freezes the balances between two operations and copies the balance
+        file to `dest` on another thread, so the main loop goes on meanwhile.
+        """
+        if not isinstance(self.bank, MmapBankStorage):
+            raise ValueError("Checkpoints need a memory-mapped storage")
+        # the state the copy will hold once the frozen balances are put back
+        state = copy.deepcopy(
+            {
+                "id": self.id,
+                "epoch": self.epoch,
+                "addrs": self.addrs,
+                "clock": {"b": self.now.b, "r": self.now.r},
+                "max_r": self.max_r,
+                "escrow": self.escrow.export_shares() if self.escrow else None,
+            }
+        )
+        self.bank.begin_checkpoint()
+        self.checkpointing = True
+
+        def copy_file():
+            try:
+                self.bank.copy_to(dest)
+                error = None
+            except OSError as e:
+                error = e
+            self.checkpoint_done.put((dest, res_queue, state, error))
+
+        threading.Thread(target=copy_file, daemon=True).start()
+
+    def _end_checkpoint(
+        self, dest: str, res_queue: Queue, state: dict, error: Optional[OSError]
+    ) -> None:
+        """
+        Puts the frozen balances back into the copy and writes the clock it
+        matches to `dest`.json.
+        """
+        self.checkpointing = False
+        try:
+            self.bank.end_checkpoint(dest if error is None else None)
+            if error is not None:
+                raise error
+            with open(f"{dest}.json", "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            res_queue.put(True)
+        except OSError as e:
+            res_queue.put(ValueError(f"checkpoint failed: {e}"))
+
+    def _process_checkpoint_queue(self) -> None:
+        while not self.checkpoint_done.empty():
+            self._end_checkpoint(*self.checkpoint_done.get())
+        # one copy at a time, the others wait in the queue
+        while not self.checkpointing and not self.checkpoint_queue.empty():
+            dest, res_queue, deadline = self.checkpoint_queue.get()
+            if deadline < time.monotonic():
+                # the caller gave up, do not copy for nobody
+                res_queue.put(ValueError("Checkpoint deadline exceeded"))
+                continue
+            try:
+                self._begin_checkpoint(dest, res_queue)
+            except ValueError as e:
+                res_queue.put(ValueError(f"checkpoint failed: {e}"))
+
+    def _process_update_queue(self) -> None:
+        while not self.update_queue.empty():
+            update, res_queue = self.update_queue.get()
+            if "rejoined" not in update:
+                res_queue.put(self._apply_membership(update))
+                continue
+            try:
+                res_queue.put(self._catch_up(update["rejoined"], update["clock"]))
+            except ValueError as e:
+                res_queue.put(e)
+
+    def _process_member_queue(self) -> None:
+        while not self.member_queue.empty():
+            self.pending_members.append(self.member_queue.get())
+        # membership changes are serialized by the red token of partition 0
+        if not self.has_token[0]:
+            return
+        while self.pending_members and self.running:
+            kind, addr, res_queue, deadline = self.pending_members.popleft()
+            if deadline < time.monotonic():
+                # the caller gave up, so a joiner would never get its snapshot
+                res_queue.put(ValueError("Membership change deadline exceeded"))
+                continue
+            try:
+                if kind == "join":
+                    res_queue.put(self._admit(addr))
+                else:
+                    self._leave()
+                    res_queue.put(True)
+            except ValueError as e:
+                res_queue.put(e)
+
+    def _process_decode_rings(self) -> None:
+        """
+        Moves the requests, shadow operations and tokens the decode workers
+        put in their rings to the queues. Shadow operations stay in the rings
+        while too many wait to be taken in, so that the workers reject new
+        ones. Tokens are taken after the shadow operations, so those riding
+        along with a token are queued before it unless they stay in a ring.
+        """
+        for rings in self.decode_pool.rings:
+            while True:
+                record = rings.requests.pop()
+                if record is None:
+                    break
+                req_id, req, deadline = unpack_request(record)
+                req_item = RequestItem(
+                    req=req,
+                    res_queue=RingResponder(rings.responses, req_id),
+                    deadline=deadline,
+                )
+                try:
+                    self.req_queue.put_nowait(req_item)
+                except Full:
+                    req_item.res_queue.put(
+                        self._busy("Server busy", self.config.retry_after)
+                    )
+            while self.shadow_queue.qsize() < self.config.max_shadow:
+                record = rings.shadows.pop()
+                if record is None:
+                    break
+                self.shadow_queue.put(unpack_shadow(record))
+            while True:
+                record = rings.tokens.pop()
+                if record is None:
+                    break
+                self.token_queue.put(unpack_token(record))
+
+    def _start_tokens(self) -> None:
+        # spread the initial tokens so that partitions start on different servers
+        for partition in range(self.config.num_partitions):
+            if partition % len(self.addrs) == self.id:
+                self._set_token_timeout(partition)
+                self.has_token[partition] = True
+
+    def _main_loop(self) -> None:
+        # the tokens went on without a joined or restored server
+        if not self.config.join and not self.config.restore_path:
+            self._start_tokens()
+
+        while self.running:
+            try:
+                self._step()
             except ValueError as e:
                 print(f"ValueError in main_loop: {e}")
 
-    def pass_token(self, max_r: int) -> None:
+    def _step(self) -> None:
+        """
+        Runs one round of the main loop over every queue.
+        """
+        self.backlogged = any(peer is not None and peer.backlogged() for peer in self.peers)
+        self._process_update_queue()
+        self._process_token_queue()
+        self._process_member_queue()
+        if not self.running:
+            return
+        if self.decode_pool:
+            self._process_decode_rings()
+        self._process_shadow_queue()
+        self._process_release_queue()
+        self._process_req_queue()
+        self._process_op_list()
+        self._process_red_list()
+        if self.escrow:
+            self._process_pool_accounts()
+        self._process_checkpoint_queue()
+        if self.recorder:
+            self.recorder.flush()
+
+    def pass_token(
+        self,
+        max_r: int,
+        partition: int = 0,
+        ops: Optional[list] = None,
+        clock: Optional[dict] = None,
+    ) -> None:
         """
         This method is a RPC handler provided by the server.
         Passes the token to the next server.
 
         Args:
             max_r (int): The maximum red value seen by the server.
+            partition (int): The partition of the token.
+            ops (Optional[list]): Shadow operations of the previous holder,
+                encoded by encode_ops.
+            clock (Optional[dict]): The clock of the previous holder, which
+                the clocks of `ops` are relative to.
         """
-        self.token_queue.put(max_r)
+        # queue the operations first, so the main loop applies them in the
+        # round it takes the token and can be primary right away
+        if ops:
+            for shadow in decode_ops(clock, ops):
+                self.shadow_queue.put(shadow)
+        self.token_queue.put((partition, max_r))
 
     def add_shadow_op(self, shadow: dict) -> None:
         """
@@ -302,9 +1320,40 @@ class Server:
 
         Args:
             shadow (ShadowOp): The shadow operation to add.
+
+        Raises:
+            Fault: If too many shadow operations wait to be taken in.
+                The sender is expected to retry later.
         """
+        if self.shadow_queue.qsize() >= self.config.max_shadow:
+            raise Fault(FAULT_BUSY, "Server busy")
         self.shadow_queue.put(ShadowOp.from_dict(shadow))
 
+    def add_shadow_op_delta(self, msg: list) -> bool:
+        """
+        This method is a RPC handler provided by the server.
+        Adds a shadow operation sent on a delta encoded stream to the queue.
+
+        Args:
+            msg (list): The message, see ClockEncoder.encode.
+
+        Returns:
+            bool: False if the message does not follow the last one of its
+                stream, so the sender has to resend the whole clock.
+
+        Raises:
+            Fault: If too many shadow operations wait to be taken in.
+                The message is not decoded and the sender is expected to
+                resend it later.
+        """
+        if self.shadow_queue.qsize() >= self.config.max_shadow:
+            raise Fault(FAULT_BUSY, "Server busy")
+        shadow = self.clock_decoder.decode(msg)
+        if shadow is None:
+            return False
+        self.shadow_queue.put(shadow)
+        return True
+
     def request(self, req_dict: dict) -> dict:
         """
         This method is a RPC handler provided by the server.
@@ -316,44 +1365,188 @@ class Server:
         Returns:
             Response: The response object generated by processing the request.
 
+        If the request queue is full, or the request misses its deadline,
+        a busy or timeout response is returned instead of blocking.
+
         Raises:
             ValueError: If the request processing fails.
         """
+        if not self.running:
+            # nobody would answer the request
+            return self._busy("Server left the cluster", self.config.retry_after).to_dict()
         res_queue = Queue()
-        req = None
-        if len(req_dict) == 3:
-            aid = req_dict["aid"]
-            amount = req_dict["amount"]
-            if req_dict["cmd"] == "DEPOSIT":
-                op = REQ.DEPOSIT
-            elif req_dict["cmd"] == "WITHDRAW":
-                op = REQ.WITHDRAW
-
-            req = Request(aid, op, amount)
-
-        elif len(req_dict) == 2:
-            if req_dict["cmd"] == "INTEREST":
-                op = REQ.INTEREST
-                aid = req_dict["aid"]
-                req = Request(aid, op)
-            elif req_dict["cmd"] == "CHECK":
-                op = REQ.CHECK
-                aid = req_dict["aid"]
-                req = Request(aid, op)
-
-        req_item = RequestItem(req=req, res_queue=res_queue)
-        self.req_queue.put(req_item)
-        res = res_queue.get()
+        req = Request.from_dict(req_dict)
+
+        timeout = self.config.request_timeout
+        req_item = RequestItem(
+            req=req, res_queue=res_queue, deadline=time.monotonic() + timeout
+        )
+        try:
+            self.req_queue.put_nowait(req_item)
+            # wait a little longer than the deadline so that the main loop
+            # answers expired requests itself and the two never disagree
+            res = res_queue.get(timeout=timeout + TOKEN_HOLD)
+        except Full:
+            res = self._busy("Server busy", self.config.retry_after)
+        except Empty:
+            res = Response(status=STATUS_TIMEOUT, message="Request deadline exceeded")
 
         if res is None:
             raise ValueError("Server.Request failed")
         assert isinstance(res, Response)
-        res_dict = {
-            "status": res.status,
-            "balance": res.balance,
-            "message": res.message,
-        }
-        return res_dict
+        return res.to_dict()
+
+    def join(self, addr: str) -> dict:
+        """
+        This method is a RPC handler provided by the server.
+        Adds the server at `addr` to the cluster once this server holds the
+        token, and returns the state the new server starts from.
+
+        Args:
+            addr (str): The address of the new server.
+
+        Returns:
+            dict: The id, membership, clock and balances for the new server.
+
+        Raises:
+            Fault: If the server left the cluster.
+            ValueError: If the membership cannot change in this configuration,
+                or the server did not get the token before the request timeout.
+        """
+        self._check_membership_supported()
+        return self._wait_member_change("join", addr)
+
+    def leave(self) -> bool:
+        """
+        This method is a RPC handler provided by the server.
+        Removes this server from the cluster once it holds the token.
+
+        Returns:
+            bool: True once the server left.
+
+        Raises:
+            Fault: If the server left the cluster.
+            ValueError: If the membership cannot change in this configuration,
+                or the server did not get the token before the request timeout.
+        """
+        self._check_membership_supported()
+        return self._wait_member_change("leave", None)
+
+    def _check_membership_supported(self) -> None:
+        if self.config.dissemination != DISSEMINATION_DIRECT:
+            raise ValueError("Dynamic membership needs direct dissemination")
+        # a joiner is caught up by the origin's clock entry, which only
+        # identifies the operations a snapshot covers with full dependencies
+        if self.config.dependency != DEPENDENCY_FULL:
+            raise ValueError("Dynamic membership needs full dependencies")
+
+    def _wait(self, queue: Queue, item: tuple):
+        """
+        Puts `item`, followed by the response queue and a deadline, in a queue
+        of the main loop and returns the response.
+
+        Raises:
+            Fault: If the server left the cluster.
+            ValueError: If the main loop failed or did not answer in time.
+        """
+        if not self.running:
+            raise Fault(FAULT_BUSY, "Server left the cluster")
+        res_queue = Queue()
+        timeout = self.config.request_timeout
+        queue.put(item + (res_queue, time.monotonic() + timeout))
+        try:
+            # as for requests, the main loop answers expired items itself
+            res = res_queue.get(timeout=timeout + TOKEN_HOLD)
+        except Empty as e:
+            raise ValueError("Server did not answer in time") from e
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    def _wait_member_change(self, kind: str, addr: Optional[str]):
+        return self._wait(self.member_queue, (kind, addr))
+
+    def checkpoint(self, dest: str) -> bool:
+        """
+        This method is a RPC handler provided by the server.
+        Copies the memory-mapped balance file between two operations.
+
+        Args:
+            dest (str): The path of the copy on the server's machine.
+
+        Returns:
+            bool: True once the checkpoint is written.
+
+        Raises:
+            Fault: If the server left the cluster.
+            ValueError: If the server has no balance file, the copy fails or
+                the main loop does not get to it before the request timeout.
+        """
+        return self._wait(self.checkpoint_queue, (dest,))
+
+    def release_escrow(self, aid: int) -> None:
+        """
+        This method is a RPC handler provided by the server.
+        Asks the server to return its escrow share of an account to the pool,
+        so that a red withdrawal on another server can use it.
+
+        Args:
+            aid (int): The account ID.
+        """
+        if self.escrow:
+            self.release_queue.put(aid)
+
+    def update_members(self, update: dict) -> bool:
+        """
+        This method is a RPC handler provided by the server.
+        Applies a membership update made by the token holder. A server that
+        left the cluster still applies updates while it hands tokens on.
+
+        Args:
+            update (dict): The epoch, addresses and join snapshot clock.
+
+        Returns:
+            bool: False if the update joins a server that this server cannot
+                catch up, which the token holder then removes again.
+
+        Raises:
+            ValueError: If the main loop did not answer in time.
+        """
+        res_queue = Queue()
+        self.update_queue.put((update, res_queue))
+        try:
+            return res_queue.get(timeout=self.config.request_timeout + TOKEN_HOLD)
+        except Empty as e:
+            raise ValueError("Server did not answer in time") from e
+
+    def rejoin(self, index: int, clock: List[int]) -> dict:
+        """
+        This method is a RPC handler provided by the server.
+        Resends the own shadow operations that a server restored from a
+        checkpoint does not cover.
+
+        Args:
+            index (int): The index of the restored server.
+            clock (List[int]): The b entries of the checkpoint's clock.
+
+        Returns:
+            dict: The epoch and addresses of the membership.
+
+        Raises:
+            ValueError: If the membership cannot change in this configuration,
+                the server cannot be caught up, or the main loop did not
+                answer in time.
+        """
+        self._check_membership_supported()
+        res_queue = Queue()
+        self.update_queue.put(({"rejoined": index, "clock": clock}, res_queue))
+        try:
+            res = res_queue.get(timeout=self.config.request_timeout + TOKEN_HOLD)
+        except Empty as e:
+            raise ValueError("Server did not answer in time") from e
+        if isinstance(res, Exception):
+            raise res
+        return res
 
     def dump(self) -> None:
         """
@@ -1,9 +1,14 @@
 import sys
 from redblue_demo.client.client import Client
+from redblue_demo.client.cluster_client import ClusterClient
 from redblue_demo.common.common import Response
 
 if __name__ == "__main__":
-    client = Client(sys.argv[1])
+    if len(sys.argv) > 2:
+        # 多个副本地址时使用集群客户端
+        client = ClusterClient(sys.argv[1:], hedge_delay=0.5)
+    else:
+        client = Client(sys.argv[1])
     print("Connected!")
     while True:
         line = input()
@@ -29,7 +34,11 @@ if __name__ == "__main__":
         elif len(parts) == 2:
             cmd, arg1 = parts
             arg1 = int(arg1)
-            res_dict = client.request({"cmd": "INTEREST", "aid": arg1})
+            if cmd == "check":
+                # 查询余额，集群客户端会对慢副本进行对冲
+                res_dict = client.request({"cmd": "CHECK", "aid": arg1})
+            else:
+                res_dict = client.request({"cmd": "INTEREST", "aid": arg1})
         else:
             print("Retry.")
         print(res_dict)
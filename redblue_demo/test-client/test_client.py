@@ -1,18 +1,19 @@
 """
 This module contains a test client script for the redblue_demo application.
 
-The script creates multiple instances of the `Client` class and performs various operations 
-such as deposit, interest calculation, withdrawal, 
-and checking account balance on different servers.
+The script creates one `ClusterClient` pinned to each server and performs various operations
+such as deposit, interest calculation, withdrawal,
+and checking account balance on different servers. A last case sends requests
+through one `ClusterClient` over all servers with hedged CHECKs.
 """
 
 import sys
 import time
 from typing import List
-from redblue_demo.client.client import Client
+from redblue_demo.client.cluster_client import ClusterClient
 
 
-def case1(rpc_clients: List[Client]):
+def case1(rpc_clients: List[ClusterClient]):
     """
     Executes a series of operations on the specified RPC clients for account 20.
     server 0: deposit 1000
@@ -21,7 +22,7 @@ def case1(rpc_clients: List[Client]):
     server 1: withdraw 2500
 
     Args:
-        rpc_clients (List[Client]): A list of RPC clients.
+        rpc_clients (List[ClusterClient]): A list of RPC clients.
 
     Returns:
         None
@@ -45,14 +46,14 @@ def case1(rpc_clients: List[Client]):
     print(f"[account 20] CHECK server 2: {res}")
 
 
-def case2(rpc_clients: List[Client]):
+def case2(rpc_clients: List[ClusterClient]):
     """
     Executes a test case for withdrawing funds from account 21 using multiple RPC clients.
     server 0: withdraw 800
     server 1: withdraw 800
 
     Args:
-        rpc_clients (List[Client]): A list of RPC clients.
+        rpc_clients (List[ClusterClient]): A list of RPC clients.
 
     Returns:
         None
@@ -72,10 +73,37 @@ def case2(rpc_clients: List[Client]):
     print(f"[account 21] CHECK server 2: {res}")
 
 
+def case3(cluster_client: ClusterClient):
+    """
+    Executes a test case for account 22 through a client of the whole cluster.
+    any server: deposit 500
+    any server: withdraw 200
+    any server, hedged: check
+
+    Args:
+        cluster_client (ClusterClient): A client of all servers.
+
+    Returns:
+        None
+    """
+    print("------------test case 3-------------")
+    res = cluster_client.request({"cmd": "DEPOSIT", "aid": 22, "amount": 500})
+    print(f"[account 22] DEPOSIT any server (+ 500): {res}")
+    res = cluster_client.request({"cmd": "WITHDRAW", "aid": 22, "amount": 200})
+    print(f"[account 22] WITHDRAW any server (- 200): {res}")
+    time.sleep(5)
+    print("-----------------")
+    for _ in range(3):
+        res = cluster_client.request({"cmd": "CHECK", "aid": 22})
+        print(f"[account 22] CHECK any server: {res}")
+
+
 if __name__ == "__main__":
-    clients = []
-    for i in range(len(sys.argv) - 1):
-        clients.append(Client(sys.argv[i + 1]))
+    addrs = sys.argv[1:]
+    clients = [ClusterClient([addr]) for addr in addrs]
 
     case1(clients)
     case2(clients)
+    cluster_client = ClusterClient(addrs, hedge_delay=0.5)
+    case3(cluster_client)
+    cluster_client.close()
@@ -5,4 +5,4 @@ export PYTHONPATH
 
 pkill cmd_client
 
-python3 redblue_demo/test-client/cmd_client.py "$1"
+python3 redblue_demo/test-client/cmd_client.py "$@"